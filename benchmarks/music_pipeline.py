@@ -0,0 +1,304 @@
+"""Offline throughput benchmark of the music extension audio pipeline
+
+Songs of generated local media are queued to VoiceState and played through
+YTDLSource sources into fake voice clients, which read their source on the
+20 ms cadence of the discord audio player. Opus encoding of PCM frames done
+by the real voice client is not included. Reports frames per second, frame
+jitter, CPU per stream and time to first frame as concurrent guilds grow.
+
+Needs only ffmpeg, run from the repository root:
+
+    python -m benchmarks.music_pipeline --guilds 1 2 4 8 16 --duration 20
+"""
+import argparse
+import asyncio
+import os
+import resource
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from typing import List
+
+from extensions.music.song import Song
+from extensions.music.streamscheduler import get_stream_scheduler
+from extensions.music.voicestate import VoiceState
+from extensions.music.ytdlsource import YTDLSource
+
+FRAME_LENGTH = 0.02
+
+
+class Play:
+    """Frame timings of one played song"""
+
+    def __init__(self, handoff_from: float) -> None:
+        """Init play started waiting for its first frame at handoff_from"""
+        self.handoff_from = handoff_from
+        self.first_frame_at = None
+        self.intervals = []
+        self.frames = 0
+        self.elapsed = 0.0
+
+    @property
+    def ttff(self) -> float:
+        """Time to first frame in seconds"""
+        return self.first_frame_at - self.handoff_from
+
+
+class FakeVoiceClient:
+    """Voice client reading its source like discord.player.AudioPlayer"""
+
+    def __init__(self, plays: List[Play]) -> None:
+        """Init voice client recording finished plays to plays"""
+        self.plays = plays
+        self.channel = FakeChannel(None)
+        self.handoff_from = time.monotonic()
+        self.source = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def play(self, source, *, after=None) -> None:
+        """Start reading source in a player thread"""
+        self.source = source
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, args=(after,), daemon=True)
+        self._thread.start()
+
+    def _run(self, after) -> None:
+        """Read 20 ms frames until the source ends"""
+        play = Play(self.handoff_from)
+        error = None
+        loops = 0
+        start = last = None
+        try:
+            while not self._stopped.is_set():
+                data = self.source.read()
+                now = time.perf_counter()
+                if not data:
+                    break
+                if start is None:
+                    play.first_frame_at = time.monotonic()
+                    start = now
+                else:
+                    play.intervals.append(now - last)
+                last = now
+                loops += 1
+                time.sleep(max(0.0, start + FRAME_LENGTH * loops - time.perf_counter()))
+        except Exception as err:  # pylint: disable=broad-except
+            error = err
+        finally:
+            self.source.cleanup()
+        self.handoff_from = time.monotonic()
+        if start is not None:
+            play.frames = loops
+            play.elapsed = last - start
+            self.plays.append(play)
+        if after is not None:
+            after(error)
+
+    def is_playing(self) -> bool:
+        """Check if a source is being read"""
+        return (
+            self._thread is not None
+            and self._thread.is_alive()
+            and not self._stopped.is_set()
+        )
+
+    def is_paused(self) -> bool:
+        """Fake voice client can't be paused"""
+        return False
+
+    def stop(self) -> None:
+        """Stop reading the source"""
+        self._stopped.set()
+
+    async def disconnect(self) -> None:
+        """Stop reading the source"""
+        self.stop()
+
+
+class FakeChannel:
+    """Text channel swallowing messages"""
+
+    def __init__(self, guild) -> None:
+        self.guild = guild
+        self.name = "benchmark"
+
+    async def send(self, *args, **kwargs) -> None:
+        """Drop message"""
+
+
+class FakeGuild:
+    """Guild with just an id"""
+
+    def __init__(self, guild_id: int) -> None:
+        self.id = guild_id  # pylint: disable=invalid-name
+        self.name = f"guild {guild_id}"
+
+
+class FakeUser:
+    """Requester of songs"""
+
+    display_name = "benchmark"
+
+
+class FakeContext:
+    """Command context of a song request"""
+
+    def __init__(self, guild_id: int) -> None:
+        self.guild = FakeGuild(guild_id)
+        self.channel = FakeChannel(self.guild)
+        self.author = FakeUser()
+
+
+class FakeBot:
+    """Bot with just the event loop"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+
+
+def generate_media(directory: str, duration: int) -> str:
+    """Generate a stereo Opus webm file like YouTube audio streams"""
+    path = os.path.join(directory, "sine.webm")
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            f"sine=frequency=440:sample_rate=48000:duration={duration}",
+            "-ac",
+            "2",
+            "-c:a",
+            "libopus",
+            "-b:a",
+            "128k",
+            "-y",
+            path,
+        ],
+        check=True,
+    )
+    return path
+
+
+def song_info(url: str, path: str, duration: int) -> dict:
+    """Resolved info of a local song whose stream url never expires"""
+    return {
+        "title": os.path.basename(path),
+        "webpage_url": url,
+        "url": path,
+        "duration": duration,
+        "stream_expires_at": float("inf"),
+    }
+
+
+def cpu_seconds() -> float:
+    """CPU time of the process and its reaped children"""
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+async def run_level(guilds: int, args: argparse.Namespace, path: str) -> dict:
+    """Play songs in given number of guilds at once and summarize the plays"""
+    loop = asyncio.get_event_loop()
+    plays = []
+    states = []
+    cpu_before = cpu_seconds()
+    wall_before = time.perf_counter()
+    for guild_id in range(guilds):
+        ctx = FakeContext(guild_id)
+        state = VoiceState(FakeBot(loop), ctx.guild)
+        state.playback_mode = args.mode
+        state.prefetch_depth = args.prefetch
+        state.voice = FakeVoiceClient(plays)
+        states.append(state)
+        for index in range(args.songs):
+            url = f"benchmark://{guilds}/{guild_id}/{index}"
+            await state.songs.put(Song(ctx, song_info(url, path, args.duration)))
+
+    total = guilds * args.songs
+    deadline = time.monotonic() + args.songs * (args.duration + 30)
+    while len(plays) < total and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    wall = time.perf_counter() - wall_before
+    for state in states:
+        await state.close()
+    cpu = cpu_seconds() - cpu_before
+    if not plays:
+        raise RuntimeError(f"No song finished playing with {guilds} guilds")
+
+    intervals = [interval for play in plays for interval in play.intervals]
+    ttffs = sorted(play.ttff for play in plays)
+    return {
+        "guilds": guilds,
+        "plays": len(plays),
+        "fps": statistics.mean(
+            (play.frames - 1) / play.elapsed for play in plays if play.elapsed
+        ),
+        "jitter": statistics.mean(abs(i - FRAME_LENGTH) for i in intervals) * 1000,
+        "p99": _quantile(sorted(intervals), 0.99) * 1000,
+        "late": sum(i > 2 * FRAME_LENGTH for i in intervals) / len(intervals),
+        "cpu": cpu / wall / guilds * 100,
+        "ttff50": _quantile(ttffs, 0.5) * 1000,
+        "ttff95": _quantile(ttffs, 0.95) * 1000,
+    }
+
+
+def _quantile(values: list, fraction: float) -> float:
+    """Nearest rank quantile of sorted values"""
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def main(args: argparse.Namespace) -> None:
+    """Run benchmark for each number of guilds"""
+    # Reconnect options apply to http streams only
+    YTDLSource.FFMPEG_OPTIONS = {"before_options": "", "options": "-vn"}
+    get_stream_scheduler().budget = args.budget or float("inf")
+    print(
+        f"mode={args.mode} songs={args.songs} duration={args.duration}s"
+        f" prefetch={args.prefetch}"
+    )
+    print(
+        "guilds  plays   fps/stream  jitter ms  p99 ms  late %"
+        "  cpu %/stream  ttff p50 ms  ttff p95 ms"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        path = generate_media(directory, args.duration)
+        for guilds in args.guilds:
+            result = await run_level(guilds, args, path)
+            print(
+                f"{result['guilds']:>6}  {result['plays']:>5}"
+                f"  {result['fps']:>10.2f}  {result['jitter']:>9.2f}"
+                f"  {result['p99']:>6.1f}  {result['late']:>6.2%}"
+                f"  {result['cpu']:>12.1f}  {result['ttff50']:>11.0f}"
+                f"  {result['ttff95']:>11.0f}"
+            )
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--songs", type=int, default=2, help="songs per guild")
+    parser.add_argument(
+        "--duration", type=int, default=20, help="song length in seconds"
+    )
+    parser.add_argument("--mode", choices=("pcm", "opus"), default="pcm")
+    parser.add_argument(
+        "--prefetch", type=int, default=2, help="prefetch depth, 0 disables it"
+    )
+    parser.add_argument(
+        "--budget", type=int, default=0, help="stream budget, 0 for unlimited"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,144 @@
+"""Memory benchmark of music queue entries
+
+Measures with tracemalloc the memory retained by a queue of songs built
+from synthetic yt-dlp info shaped like YouTube results, compared to
+holding the full info or the info with heavy keys dropped, as the info
+cache does. Run from the repository root:
+
+    python -m benchmarks.music_queue_memory --songs 500
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+from typing import Callable
+
+from extensions.music.song import Song
+from extensions.music.songqueue import SongQueue
+from extensions.music.ytdlsource import YTDLSource
+
+
+class FakeContext:
+    """Command context shared by all queued songs"""
+
+    author = "benchmark"
+    channel = "benchmark"
+
+
+def make_info(index: int) -> str:
+    """Synthetic yt-dlp info of a YouTube video as JSON"""
+    video_id = f"{index:011d}"
+    stream_url = (
+        f"https://rr1---sn-example.googlevideo.com/videoplayback?expire=1700000000"
+        f"&id={video_id}&itag=251&source=youtube&mime=audio%2Fwebm&{'x' * 600}"
+    )
+    formats = [
+        {
+            "format_id": str(itag),
+            "url": stream_url.replace("itag=251", f"itag={itag}"),
+            "ext": "webm",
+            "acodec": "opus",
+            "vcodec": "none",
+            "abr": 160,
+            "asr": 48000,
+            "filesize": 3_000_000 + itag,
+            "format_note": "medium",
+            "http_headers": {
+                "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) Chrome/96.0",
+                "Accept": "text/html,application/xhtml+xml",
+                "Accept-Language": "en-us,en;q=0.5",
+            },
+            "downloader_options": {"http_chunk_size": 10485760},
+        }
+        for itag in range(18, 48)
+    ]
+    info = {
+        "id": video_id,
+        "title": f"Artist {index % 50} - Song number {index} (Official Video)",
+        "webpage_url": f"https://www.youtube.com/watch?v={video_id}",
+        "url": stream_url,
+        "uploader": f"Artist {index % 50}",
+        "uploader_url": f"https://www.youtube.com/channel/UC{index % 50:022d}",
+        "upload_date": "20211201",
+        "thumbnail": f"https://i.ytimg.com/vi/{video_id}/maxresdefault.jpg",
+        "duration": 180 + index % 120,
+        "description": "Lyrics and credits. " * 100,
+        "tags": [f"tag {tag}" for tag in range(20)],
+        "categories": ["Music"],
+        "formats": formats,
+        "requested_formats": formats[:2],
+        "thumbnails": [
+            {"url": f"https://i.ytimg.com/vi/{video_id}/{size}.jpg", "id": str(size)}
+            for size in range(40)
+        ],
+        "automatic_captions": {
+            lang: [{"ext": "vtt", "url": stream_url}] for lang in ("en", "de", "cs")
+        },
+    }
+    return json.dumps(info)
+
+
+def measure(build: Callable[[list], object], infos: list) -> int:
+    """Bytes retained by the structure build creates from JSON infos"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    structure = build(infos)
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del structure
+    return retained
+
+
+def full_info(infos: list) -> list:
+    """Queue of full yt-dlp info dicts"""
+    return [json.loads(info) for info in infos]
+
+
+def trimmed_info(infos: list) -> list:
+    """Queue of info dicts with heavy keys dropped"""
+    queue = []
+    for info in infos:
+        info = json.loads(info)
+        queue.append(
+            {
+                key: value
+                for key, value in info.items()
+                if key not in YTDLSource.HEAVY_INFO_KEYS
+            }
+        )
+    return queue
+
+
+def songs(infos: list) -> SongQueue:
+    """Song queue of compact tracks"""
+    ctx = FakeContext()
+    queue = SongQueue()
+    for info in infos:
+        queue.put_nowait(Song(ctx, json.loads(info)))
+    return queue
+
+
+def main() -> None:
+    """Run benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--songs", type=int, default=500)
+    args = parser.parse_args()
+
+    infos = [make_info(index) for index in range(args.songs)]
+    print(f"{args.songs} songs, {sum(map(len, infos)) // 1024} KiB of info JSON")
+    for name, build in (
+        ("full info", full_info),
+        ("trimmed info", trimmed_info),
+        ("songs", songs),
+    ):
+        retained = measure(build, infos)
+        print(
+            f"{name:>12}: {retained / 1024:10.1f} KiB,"
+            f" {retained / args.songs:8.0f} B per song"
+        )
+
+
+if __name__ == "__main__":
+    main()
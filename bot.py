@@ -8,12 +8,14 @@ from discord.ext import commands
 
 from core.config import get_config
 from core.logger import get_logger
+from core.prefixes import get_prefix_resolver
 
 init(autoreset=True)
 pretty_errors.activate()
 print(f"{Fore.YELLOW}[*] Coco loading...")
 config = get_config()
 logger = get_logger(__name__)
+prefix_resolver = get_prefix_resolver()
 logger.info("Configuration & logger loaded")
 
 
@@ -25,17 +27,9 @@ async def get_prefix(bot, message):
     """Gets specified prefix for guild if set.
     If not set, prefix defaults to "coco ".
 
-    Returns when_mentioned_or(prefix) function needed for pycord.
+    Returns bot mentions and the prefix, cached per guild by the resolver.
     """
-    if message.guild is None:
-        prefix = config.default_prefix
-    elif str(message.guild.id) not in config.prefixes:
-        config.prefixes[str(message.guild.id)] = config.default_prefix
-        config.save()
-        prefix = config.default_prefix
-    else:
-        prefix = config.prefixes.get(str(message.guild.id))
-    return commands.when_mentioned_or(prefix)(bot, message)
+    return await prefix_resolver.resolve(bot, message)
 
 
 logger.info("Coco started at %s", datetime.now().strftime("%d/%m/%Y %H:%M:%S"))
@@ -5,6 +5,7 @@ from discord.ext import commands
 
 from core.config import get_config
 from core.logger import get_logger
+from core.metrics import get_registry
 
 
 class BaseCog(commands.Cog):
@@ -21,24 +22,39 @@ class BaseCog(commands.Cog):
 
         Used for logging chat commands.
         """
-        author = ctx.author
-        message = f"{author.name}#{author.discriminator} issued the command `{ctx.command.name}`"
-        chat = ctx.guild.name if ctx.guild else "Direct message"
-        log_message = f"{message} in {chat}."
-        self.logger.debug(log_message)
-        ctx.start = time.time()
+        self.logger.debug(
+            "%s#%s issued the command `%s` in %s.",
+            ctx.author.name,
+            ctx.author.discriminator,
+            ctx.command.name,
+            ctx.guild.name if ctx.guild else "Direct message",
+        )
+        ctx.start = time.monotonic()
         return ctx
 
     async def cog_after_invoke(self, ctx: commands.Context) -> None:
         """Code that runs after invoked command.
 
-        Used for logging how long command took to complete.
+        Used for recording how long command took to complete and whether it failed.
         """
-        end = time.time()
-        delta = end - ctx.start
-        log_message = f"Command {ctx.command.name} successfully completed after"
-        log_message += f" {format(delta, '.2f')} seconds."
-        self.logger.debug(log_message)
+        if not hasattr(ctx, "start"):
+            return
+        elapsed = time.monotonic() - ctx.start
+        labels = {"cog": self.__class__.__name__, "command": ctx.command.qualified_name}
+        registry = get_registry()
+        registry.histogram(
+            "coco_command_seconds", "Time to complete a command", **labels
+        ).observe(elapsed)
+        if ctx.command_failed:
+            registry.counter(
+                "coco_command_errors_total", "Commands that failed", **labels
+            ).inc()
+            return
+        self.logger.debug(
+            "Command %s successfully completed after %.2f seconds.",
+            ctx.command.name,
+            elapsed,
+        )
 
     @commands.Cog.listener()
     async def on_error(
@@ -4,53 +4,102 @@ This module loads the configuration from configuration file.
 Provides acess to Config class and config singleton
 """
 import json
+import os
 import sys
+from types import MappingProxyType
+from typing import Any, Callable, Mapping
 
 from colorama import Fore, init
 
 init(autoreset=True)
 
 
+def _freeze(value: Any) -> Any:
+    """Copy json value into read-only mappings and tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _merge(default_json: dict, config_json: dict) -> MappingProxyType:
+    """Merge configuration over defaults into a read-only copy
+
+    Sections present in both files are merged key by key.
+    """
+    merged = {}
+    for group in {**default_json, **config_json}:
+        default = default_json.get(group)
+        value = config_json.get(group, default)
+        if isinstance(value, dict) and isinstance(default, dict):
+            value = {**default, **value}
+        merged[group] = _freeze(value)
+    return MappingProxyType(merged)
+
+
 class Config:
     """Config class
 
     This class loads the configuration from configuration file.
     Returns object of Config class.
+
+    Values are read from a merged read-only snapshot, reload swaps it
+    for a new one at once and notifies subscribers of changed sections.
+    Changes are written to the configuration file contents and saved,
+    followed by a new snapshot.
     """
 
     def _get(self, group: str, key: str = None) -> str:
         """Get the value of group or key in group
 
         If value is not present in configuration file, default value is returned.
-        If key is not present in neither configuration file nor default file, None is returned.
+        If key is not present in neither configuration file nor default file, "" is returned.
         """
+        section = self._snapshot.get(group, "")
         if key is None:
-            if group in self.config_json:
-                return self.config_json[group]
-            if group in self.default_json:
-                return self.default_json[group]
-            return ""
-        if group in self.config_json and key in self.config_json[group]:
-            return self.config_json[group][key]
-        if group in self.default_json and key in self.default_json[group]:
-            return self.default_json[group][key]
+            return section
+        if isinstance(section, Mapping):
+            return section.get(key, "")
         return ""
 
     def __init__(self) -> None:
         """Initialize the Config class"""
+        self._subscribers = {}
+        self._load()
+
+    def _load(self) -> None:
+        """Load configuration files and swap in a new snapshot"""
         try:
             with open("config/config.json", "r", encoding="utf-8") as config_file:
-                self.config_json = json.load(config_file)
+                config_json = json.load(config_file)
             with open("config/default.json", "r", encoding="utf-8") as default_file:
-                self.default_json = json.load(default_file)
+                default_json = json.load(default_file)
         except FileNotFoundError:
             print(f"{Fore.RED}[✗] Configuration file not found. Exiting...")
             sys.exit(1)
 
+        self.config_json = config_json
+        self.default_json = default_json
+        self._refresh()
+
+    def _refresh(self) -> None:
+        """Swap in a new snapshot of the loaded configuration"""
+        self._snapshot = _merge(self.default_json, self.config_json)
         self.prefixes = self._get("bot", "prefixes")
         self.extensions_enabled = self._get("extensions", "enabled")
         self.extensions_disabled = self._get("extensions", "disabled")
 
+    def subscribe(self, section: str, callback: Callable[[Any], None]) -> None:
+        """Call callback with the new section when it changes on reload"""
+        self._subscribers.setdefault(section, []).append(callback)
+
+    def unsubscribe(self, section: str, callback: Callable[[Any], None]) -> None:
+        """Stop notifying callback about changes of section"""
+        callbacks = self._subscribers.get(section, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
     @property
     def bot_token(self) -> str:
         """Get the bot token"""
@@ -96,30 +145,94 @@ class Config:
         """Get the openai configuration"""
         return self._get("openai")
 
+    @property
+    def logging(self) -> Mapping:
+        """Get the logging configuration"""
+        return self._get("logging") or {}
+
+    @property
+    def metrics(self) -> Mapping:
+        """Get the metrics configuration"""
+        return self._get("metrics") or {}
+
+    @property
+    def watchdog(self) -> Mapping:
+        """Get the event loop watchdog configuration"""
+        return self._get("watchdog") or {}
+
+    @property
+    def fanout(self) -> Mapping:
+        """Get the feed fan-out configuration"""
+        return self._get("fanout") or {}
+
+    @property
+    def http(self) -> Mapping:
+        """Get the shared HTTP client configuration"""
+        return self._get("http") or {}
+
+    @property
+    def storage(self) -> Mapping:
+        """Get the storage configuration"""
+        return self._get("storage") or {}
+
+    @property
+    def music(self) -> Mapping:
+        """Get the music configuration merged over defaults"""
+        return self._get("music") or {}
+
     def reload(self) -> None:
-        """Reload the configuration"""
-        self.__init__()
+        """Reload the configuration, notifying subscribers of changed sections"""
+        old = self._snapshot
+        self._load()
+        for section, callbacks in self._subscribers.items():
+            value = self._snapshot.get(section)
+            if value != old.get(section):
+                for callback in list(callbacks):
+                    callback(value)
+
+    def dumps(self) -> str:
+        """Serialize the configuration for saving"""
+        bot_json = self.config_json.setdefault("bot", {})
+        if not bot_json.get("prefixes"):
+            bot_json["prefixes"] = dict(self.prefixes)
+        return json.dumps(self.config_json, indent=4)
+
+    @staticmethod
+    def write(data: str) -> None:
+        """Atomically replace the configuration file with serialized data"""
+        tmp_path = "config/config.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as config_file:
+            config_file.write(data)
+        os.replace(tmp_path, "config/config.json")
 
     def save(self) -> None:
         """Save the configuration"""
-        if not self.config_json.get("bot").get("prefixes"):
-            self.config_json["bot"]["prefixes"] = self.prefixes
-        with open("config/config.json", "w", encoding="utf-8") as config_file:
-            json.dump(self.config_json, config_file, indent=4)
+        self.write(self.dumps())
+
+    def clear_prefixes(self) -> None:
+        """Remove guild prefixes from the configuration, without saving"""
+        self.config_json.setdefault("bot", {})["prefixes"] = {}
+        self._refresh()
+
+    def _move_extension(self, extension: str, source: str, target: str) -> None:
+        """Move extension between extension lists and save the configuration"""
+        extensions = self.config_json.setdefault("extensions", {})
+        lists = {key: list(self._get("extensions", key)) for key in (source, target)}
+        lists[source].remove(extension)
+        lists[target].append(extension)
+        extensions.update(lists)
+        self._refresh()
+        self.save()
 
     def enable_extension(self, extension: str) -> None:
         """Enable extension"""
         if extension in self.extensions_disabled:
-            self.extensions_disabled.remove(extension)
-            self.extensions_enabled.append(extension)
-            self.save()
+            self._move_extension(extension, "disabled", "enabled")
 
     def disable_extension(self, extension: str) -> None:
         """Disable extension"""
         if extension in self.extensions_enabled:
-            self.extensions_enabled.remove(extension)
-            self.extensions_disabled.append(extension)
-            self.save()
+            self._move_extension(extension, "enabled", "disabled")
 
 
 config = Config()
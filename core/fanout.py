@@ -0,0 +1,190 @@
+"""Fan-out module
+
+Provides delivery of one message to many channels at once, for cogs
+posting feed items to their subscribed channels."""
+import asyncio
+import functools
+import io
+import time
+import weakref
+from collections import namedtuple
+from typing import Iterable, Optional
+
+import aiohttp
+import discord
+from discord.ext import commands
+
+from core.config import get_config
+from core.logger import get_logger
+from core.metrics import get_registry
+
+# Channel ids by the outcome of delivering a post to them
+Delivery = namedtuple("Delivery", ("sent", "failed", "gone"))
+
+logger = get_logger(__name__)
+
+
+@functools.lru_cache(maxsize=32)
+def _read_file(path: str) -> bytes:
+    """Read attached file, assets are read only once"""
+    with open(path, "rb") as file:
+        return file.read()
+
+
+class Post:
+    """Message built once and sent to many channels
+
+    Attachments are kept as bytes, each send wraps them in new files so
+    concurrent sends do not share a file position.
+    """
+
+    __slots__ = ("content", "embed", "attachments")
+
+    def __init__(
+        self,
+        content: Optional[str] = None,
+        *,
+        embed: Optional[discord.Embed] = None,
+        attachments: Optional[dict] = None,
+    ) -> None:
+        """Init post with attachments as file names mapped to their bytes"""
+        self.content = content
+        self.embed = embed
+        self.attachments = attachments or {}
+
+    @classmethod
+    async def with_files(
+        cls,
+        content: Optional[str] = None,
+        *,
+        embed: Optional[discord.Embed] = None,
+        files: Optional[dict] = None,
+    ) -> "Post":
+        """Make post attaching files, given as file names mapped to paths"""
+        loop = asyncio.get_event_loop()
+        attachments = {}
+        for filename, path in (files or {}).items():
+            attachments[filename] = await loop.run_in_executor(None, _read_file, path)
+        return cls(content, embed=embed, attachments=attachments)
+
+    def send_kwargs(self) -> dict:
+        """Keyword arguments of Messageable.send for one channel"""
+        kwargs = {"content": self.content, "embed": self.embed}
+        if self.attachments:
+            kwargs["files"] = [
+                discord.File(io.BytesIO(data), filename=filename)
+                for filename, data in self.attachments.items()
+            ]
+        return kwargs
+
+
+class FanOut:
+    """Dispatcher sending posts to channels with bounded concurrency
+
+    Sends to one channel are serialized, as Discord rate limits message
+    creation per channel, while different channels are sent to at once
+    up to the concurrency. Rate limited, server side and connection
+    failures are retried per channel with exponential backoff, channels
+    that no longer exist are reported as gone. Delivery latency is
+    recorded per feed.
+    """
+
+    def __init__(
+        self,
+        bot: commands.Bot,
+        feed: str,
+        concurrency: int = 5,
+        retries: int = 2,
+        backoff: float = 1.0,
+    ) -> None:
+        """Init dispatcher of feed"""
+        self.bot = bot
+        self.feed = feed
+        self.retries = retries
+        self.backoff = backoff
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._buckets = weakref.WeakValueDictionary()
+        self.latency = get_registry().histogram(
+            "coco_fanout_delivery_seconds",
+            "Time to deliver a feed post to a channel",
+            feed=feed,
+        )
+
+    async def dispatch(self, channel_ids: Iterable[int], post: Post) -> Delivery:
+        """Send post to all channels, returns outcome of each"""
+        channel_ids = list(channel_ids)
+        started = time.monotonic()
+        results = await asyncio.gather(
+            *(self._deliver(channel_id, post) for channel_id in channel_ids)
+        )
+        delivery = Delivery([], [], [])
+        for channel_id, result in zip(channel_ids, results):
+            getattr(delivery, result).append(channel_id)
+        logger.debug(
+            "Delivered %s post to %d of %d channels in %.2f seconds",
+            self.feed,
+            len(delivery.sent),
+            len(channel_ids),
+            time.monotonic() - started,
+        )
+        return delivery
+
+    async def _deliver(self, channel_id: int, post: Post) -> str:
+        """Send post to channel, retrying failures that may pass"""
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            return self._count("gone")
+        bucket = self._buckets.get(channel_id)
+        if bucket is None:
+            bucket = self._buckets[channel_id] = asyncio.Lock()
+        started = time.monotonic()
+        async with bucket:
+            for attempt in range(self.retries + 1):
+                try:
+                    async with self._semaphore:
+                        await channel.send(**post.send_kwargs())
+                    self.latency.observe(time.monotonic() - started)
+                    return self._count("sent")
+                except discord.NotFound:
+                    return self._count("gone")
+                except discord.HTTPException as err:
+                    if err.status != 429 and err.status < 500:
+                        logger.warning(
+                            "Could not send %s post to %s: %s",
+                            self.feed,
+                            channel_id,
+                            err,
+                        )
+                        return self._count("failed")
+                    error = err
+                except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                    error = err
+                if attempt < self.retries:
+                    self._count("retried")
+                    await asyncio.sleep(self.backoff * 2**attempt)
+        logger.warning(
+            "Giving up sending %s post to %s: %s", self.feed, channel_id, error
+        )
+        return self._count("failed")
+
+    def _count(self, result: str) -> str:
+        """Count delivery attempt by its result"""
+        get_registry().counter(
+            "coco_fanout_deliveries_total",
+            "Feed post deliveries to channels",
+            feed=self.feed,
+            result=result,
+        ).inc()
+        return result
+
+
+def make_fanout(bot: commands.Bot, feed: str) -> FanOut:
+    """Returns dispatcher of feed configured from the fanout config"""
+    fanout_config = get_config().fanout
+    return FanOut(
+        bot,
+        feed,
+        concurrency=fanout_config.get("concurrency", 5),
+        retries=fanout_config.get("retries", 2),
+        backoff=fanout_config.get("backoff", 1.0),
+    )
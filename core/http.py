@@ -0,0 +1,268 @@
+"""HTTP module
+
+Provides one pooled aiohttp session shared by all cogs, with retries and
+per host latency and error metrics."""
+import asyncio
+import json
+import time
+from typing import Any, Optional
+from urllib.parse import urlencode, urlsplit
+
+import aiohttp
+
+from core.config import get_config
+from core.httpcache import HTTPCache
+from core.metrics import get_registry
+
+# Statuses worth retrying, the request may succeed a moment later
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+
+
+class HTTPError(Exception):
+    """Exception for failed HTTP requests"""
+
+
+class HTTPStatusError(HTTPError):
+    """Exception for HTTP responses with an error status"""
+
+    def __init__(self, response: "Response") -> None:
+        super().__init__(f"{response.status} from {response.url}")
+        self.response = response
+        self.status = response.status
+
+
+class Response:
+    """Fully read HTTP response, the connection is already back in the pool"""
+
+    __slots__ = ("url", "status", "headers", "body")
+
+    def __init__(self, url: str, status: int, headers, body: bytes) -> None:
+        """Init response"""
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def ok(self) -> bool:  # pylint: disable=invalid-name
+        """Check if status is not an error"""
+        return self.status < 400
+
+    def text(self, encoding: str = "utf-8") -> str:
+        """Body decoded as text"""
+        return self.body.decode(encoding, errors="replace")
+
+    def json(self) -> Any:
+        """Body parsed as JSON"""
+        return json.loads(self.body)
+
+
+class HTTPClient:
+    """Shared aiohttp session with keep-alive pooling and DNS caching
+
+    Idempotent requests failing on connection errors, timeouts or
+    retryable statuses are retried with exponential backoff. Latency and
+    errors are recorded per host. With a cache, GET responses are served
+    from it while fresh and revalidated once stale.
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 10,
+        dns_ttl: int = 300,
+        timeout: float = 10,
+        retries: int = 2,
+        backoff: float = 0.5,
+        user_agent: str = "Coco-bot",
+        cache: Optional[HTTPCache] = None,
+    ) -> None:
+        """Init client, the session is created on first request"""
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.user_agent = user_agent
+        self.cache = cache
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Shared session, created in the running loop on first use"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"User-Agent": self.user_agent},
+            )
+        return self._session
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        retries: Optional[int] = None,
+        raise_for_status: bool = True,
+        cache: bool = True,
+        **kwargs,
+    ) -> Response:
+        """Send request and read the whole response
+
+        Raises HTTPStatusError for error statuses unless raise_for_status
+        is off, and HTTPError when the request could not be sent. GET
+        requests go through the cache unless cache is off.
+        """
+        method = method.upper()
+        if retries is None:
+            retries = self.retries if method in IDEMPOTENT_METHODS else 0
+        if cache and self.cache is not None and method == "GET":
+            response = await self._cached_get(url, retries, **kwargs)
+        else:
+            response = await self._send(method, url, retries, **kwargs)
+        if raise_for_status and not response.ok:
+            raise HTTPStatusError(response)
+        return response
+
+    async def _cached_get(self, url: str, retries: int, **kwargs) -> Response:
+        """Send GET request through the cache"""
+        key = url
+        if kwargs.get("params"):
+            key += ("&" if "?" in url else "?") + urlencode(
+                sorted(kwargs["params"].items())
+            )
+        if self.cache.bypassed(key):
+            return await self._send("GET", url, retries, **kwargs)
+        registry = get_registry()
+        host = urlsplit(url).hostname or ""
+        entry = await self.cache.get(key)
+        if entry is not None and entry.fresh:
+            _count_cache(registry, host, "hit")
+            return Response(entry.url, entry.status, entry.headers, entry.body)
+        if entry is not None:
+            kwargs["headers"] = {**entry.validators(), **kwargs.get("headers", {})}
+        response = await self._send("GET", url, retries, **kwargs)
+        if entry is not None and response.status == 304:
+            _count_cache(registry, host, "revalidated")
+            entry = await self.cache.refresh(key, entry, response.headers)
+            return Response(entry.url, entry.status, entry.headers, entry.body)
+        _count_cache(registry, host, "miss")
+        await self.cache.store(
+            key, response.url, response.status, response.headers, response.body
+        )
+        return response
+
+    async def _send(self, method: str, url: str, retries: int, **kwargs) -> Response:
+        """Send request, retrying up to retries times"""
+        host = urlsplit(url).hostname or ""
+        registry = get_registry()
+        latency = registry.histogram(
+            "coco_http_request_seconds", "Time of HTTP requests", host=host
+        )
+        for attempt in range(retries + 1):
+            started = time.monotonic()
+            try:
+                async with self.session.request(method, url, **kwargs) as resp:
+                    body = await resp.read()
+                    response = Response(str(resp.url), resp.status, resp.headers, body)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                latency.observe(time.monotonic() - started)
+                registry.counter(
+                    "coco_http_errors_total",
+                    "Failed HTTP requests",
+                    host=host,
+                    error=type(err).__name__,
+                ).inc()
+                if attempt == retries:
+                    raise HTTPError(f"{method} {url} failed: {err!r}") from err
+                await asyncio.sleep(self.backoff * 2**attempt)
+                continue
+            latency.observe(time.monotonic() - started)
+            if response.status >= 400:
+                registry.counter(
+                    "coco_http_errors_total",
+                    "Failed HTTP requests",
+                    host=host,
+                    error=str(response.status),
+                ).inc()
+            if response.status in RETRY_STATUSES and attempt < retries:
+                await asyncio.sleep(self._retry_delay(response, attempt))
+                continue
+            return response
+        return response
+
+    def _retry_delay(self, response: Response, attempt: int) -> float:
+        """Backoff before next attempt, honoring a short Retry-After"""
+        delay = self.backoff * 2**attempt
+        try:
+            return max(delay, min(float(response.headers.get("Retry-After", 0)), 30))
+        except ValueError:
+            return delay
+
+    async def get(self, url: str, **kwargs) -> Response:
+        """Send GET request"""
+        return await self.request("GET", url, **kwargs)
+
+    async def get_json(self, url: str, **kwargs) -> Any:
+        """Send GET request and parse response as JSON"""
+        return (await self.get(url, **kwargs)).json()
+
+    async def close(self) -> None:
+        """Close session and its pooled connections"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def _count_cache(registry, host: str, result: str) -> None:
+    """Count cache lookup of host by its result"""
+    registry.counter(
+        "coco_http_cache_total", "HTTP cache lookups", host=host, result=result
+    ).inc()
+
+
+_client = None
+
+
+def get_http_client() -> HTTPClient:
+    """Returns HTTP client configured from the http config"""
+    global _client  # pylint: disable=global-statement
+    if _client is None:
+        http_config = get_config().http
+        cache_config = http_config.get("cache", {})
+        cache = None
+        if cache_config.get("enabled", True):
+            cache = HTTPCache(
+                max_entries=cache_config.get("max_entries", 1024),
+                max_body_size=cache_config.get("max_body_size", 1048576),
+                disk_path=cache_config.get("disk_path", ""),
+                disk_max_age=cache_config.get("disk_max_age", 604800),
+                routes=cache_config.get("routes", {}),
+            )
+        _client = HTTPClient(
+            limit=http_config.get("limit", 100),
+            limit_per_host=http_config.get("limit_per_host", 10),
+            dns_ttl=http_config.get("dns_ttl", 300),
+            timeout=http_config.get("timeout", 10),
+            retries=http_config.get("retries", 2),
+            backoff=http_config.get("backoff", 0.5),
+            user_agent=http_config.get("user_agent", "Coco-bot"),
+            cache=cache,
+        )
+    return _client
+
+
+async def close_http_client() -> None:
+    """Close HTTP client, a new one is created on next use"""
+    global _client  # pylint: disable=global-statement
+    if _client is not None:
+        await _client.close()
+        _client = None
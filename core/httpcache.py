@@ -0,0 +1,269 @@
+"""HTTP cache module
+
+Provides the response cache of the shared HTTP client, an in-memory LRU
+with an optional on-disk tier."""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional
+
+from multidict import CIMultiDict
+
+
+class CacheEntry:
+    """Cached response with the time until which it is fresh"""
+
+    __slots__ = ("url", "status", "headers", "body", "expires_at")
+
+    def __init__(
+        self, url: str, status: int, headers, body: bytes, expires_at: float
+    ) -> None:
+        """Init cache entry"""
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.expires_at = expires_at
+
+    @property
+    def fresh(self) -> bool:
+        """Check if entry can be used without revalidation"""
+        return time.time() < self.expires_at
+
+    @property
+    def etag(self) -> Optional[str]:
+        """ETag validator of entry"""
+        return self.headers.get("ETag")
+
+    @property
+    def last_modified(self) -> Optional[str]:
+        """Last-Modified validator of entry"""
+        return self.headers.get("Last-Modified")
+
+    def validators(self) -> dict:
+        """Conditional request headers revalidating entry"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+def _parse_cache_control(value: str) -> dict:
+    """Parse Cache-Control header into directives and their values"""
+    directives = {}
+    for directive in value.split(","):
+        name, _, argument = directive.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip('"')
+    return directives
+
+
+def _parse_date(value: Optional[str]) -> Optional[float]:
+    """Parse HTTP date into a timestamp, None if it is invalid"""
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def freshness(headers: Mapping) -> Optional[float]:
+    """Seconds the response stays fresh, None if it must not be stored
+
+    Follows Cache-Control max-age and no-cache, falling back to Expires.
+    Responses without either are stored only to be revalidated.
+    """
+    directives = _parse_cache_control(headers.get("Cache-Control", ""))
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0.0
+    for name in ("s-maxage", "max-age"):
+        if name in directives:
+            try:
+                max_age = float(directives[name])
+            except ValueError:
+                return 0.0
+            try:
+                age = float(headers.get("Age", 0))
+            except ValueError:
+                age = 0.0
+            return max(max_age - age, 0.0)
+    expires = _parse_date(headers.get("Expires"))
+    if expires is not None:
+        date = _parse_date(headers.get("Date")) or time.time()
+        return max(expires - date, 0.0)
+    return 0.0
+
+
+class HTTPCache:
+    """LRU cache of GET responses with an optional disk tier
+
+    Entries are kept while fresh by their headers or the TTL of the
+    longest route prefix matching their URL. A route TTL of 0 bypasses
+    the cache. Stale entries with a validator are kept for conditional
+    revalidation, a 304 answer refreshes them without a body.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_body_size: int = 1048576,
+        disk_path: str = "",
+        disk_max_age: float = 604800,
+        routes: Optional[Mapping[str, float]] = None,
+    ) -> None:
+        """Init cache"""
+        self.max_entries = max_entries
+        self.max_body_size = max_body_size
+        self.disk_path = disk_path
+        self.disk_max_age = disk_max_age
+        self.routes = sorted((routes or {}).items(), key=lambda route: -len(route[0]))
+        self._entries = OrderedDict()
+        self._disk_writes = 0
+
+    def route_ttl(self, url: str) -> Optional[float]:
+        """TTL of the longest route prefix of url, None if none matches"""
+        for prefix, ttl in self.routes:
+            if url.startswith(prefix):
+                return ttl
+        return None
+
+    def bypassed(self, url: str) -> bool:
+        """Check if url is never cached"""
+        return self.route_ttl(url) == 0
+
+    async def get(self, key: str) -> Optional[CacheEntry]:
+        """Cached entry of key from memory or disk, None if there is none"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry
+        if not self.disk_path:
+            return None
+        loop = asyncio.get_event_loop()
+        entry = await loop.run_in_executor(None, self._read_disk, key)
+        if entry is not None:
+            self._remember(key, entry)
+        return entry
+
+    async def store(
+        self, key: str, url: str, status: int, headers, body: bytes
+    ) -> Optional[CacheEntry]:
+        """Store response if cacheable, returns its entry"""
+        if status != 200 or len(body) > self.max_body_size:
+            return None
+        if headers.get("Vary", "").lower() not in ("", "accept-encoding"):
+            return None
+        ttl = self._ttl(key, headers)
+        if ttl is None or (
+            ttl == 0 and not ("ETag" in headers or "Last-Modified" in headers)
+        ):
+            return None
+        entry = CacheEntry(url, status, headers, body, time.time() + ttl)
+        self._remember(key, entry)
+        await self._write(key, entry)
+        return entry
+
+    async def refresh(self, key: str, entry: CacheEntry, headers) -> CacheEntry:
+        """Refresh entry with headers of a 304 response"""
+        merged = CIMultiDict(entry.headers)
+        for name in ("Cache-Control", "Expires", "Date", "ETag", "Last-Modified"):
+            if name in headers:
+                merged[name] = headers[name]
+        ttl = self._ttl(key, merged) or 0.0
+        entry = CacheEntry(
+            entry.url, entry.status, merged, entry.body, time.time() + ttl
+        )
+        self._remember(key, entry)
+        await self._write(key, entry)
+        return entry
+
+    def clear(self) -> None:
+        """Drop entries kept in memory"""
+        self._entries.clear()
+
+    def _ttl(self, key: str, headers: Mapping) -> Optional[float]:
+        """Freshness of response, overridden by its route"""
+        ttl = self.route_ttl(key)
+        return ttl if ttl is not None else freshness(headers)
+
+    def _remember(self, key: str, entry: CacheEntry) -> None:
+        """Put entry in memory, evicting least recently used ones"""
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _write(self, key: str, entry: CacheEntry) -> None:
+        """Write entry to disk tier, pruning old files now and then"""
+        if not self.disk_path:
+            return
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, self._write_disk, key, entry)
+            self._disk_writes += 1
+            if self._disk_writes % 100 == 0:
+                await loop.run_in_executor(None, self._prune_disk)
+        except OSError:
+            # The memory tier still has the entry
+            return
+
+    def _disk_file(self, key: str) -> str:
+        """Path of file keeping entry of key"""
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_path, digest)
+
+    def _read_disk(self, key: str) -> Optional[CacheEntry]:
+        """Read entry from disk, a header line of JSON followed by the body"""
+        try:
+            with open(self._disk_file(key), "rb") as file:
+                meta = json.loads(file.readline())
+                body = file.read()
+        except (OSError, ValueError):
+            return None
+        if meta.get("key") != key:
+            return None
+        return CacheEntry(
+            meta["url"],
+            meta["status"],
+            CIMultiDict(meta["headers"]),
+            body,
+            meta["expires_at"],
+        )
+
+    def _write_disk(self, key: str, entry: CacheEntry) -> None:
+        """Write entry to disk atomically"""
+        os.makedirs(self.disk_path, exist_ok=True)
+        meta = {
+            "key": key,
+            "url": entry.url,
+            "status": entry.status,
+            "headers": list(entry.headers.items()),
+            "expires_at": entry.expires_at,
+        }
+        path = self._disk_file(key)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(json.dumps(meta, separators=(",", ":")).encode("utf-8"))
+            file.write(b"\n")
+            file.write(entry.body)
+        os.replace(tmp_path, path)
+
+    def _prune_disk(self) -> None:
+        """Remove files not written for longer than the disk max age"""
+        oldest = time.time() - self.disk_max_age
+        with os.scandir(self.disk_path) as files:
+            for file in files:
+                try:
+                    if file.stat().st_mtime < oldest:
+                        os.remove(file.path)
+                except OSError:
+                    continue
@@ -1,9 +1,17 @@
 """Logging module
 
-This module provides access to logging to all modules."""
+This module provides access to logging to all modules.
+
+Loggers only put records on a queue, a listener thread writes them to
+the console and the log file, so logging never does I/O on the event loop."""
+import atexit
+import json
 import logging
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 from colorlog import ColoredFormatter
 
@@ -11,22 +19,86 @@ from core.config import get_config
 
 config = get_config()
 
+_queue = queue.SimpleQueue()
+_listener = None
+_listener_lock = threading.Lock()
 
-def get_logger(name):
-    """Returns logger formated for both console and file"""
-    logger = logging.getLogger(name)
-    if logger.hasHandlers():
-        return logger
 
-    file_formatter = logging.Formatter(
-        "%(asctime)s : %(levelname)s : %(name)s : %(message)s"
-    )
+class JsonFormatter(logging.Formatter):
+    """Formatter writing each record as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """Drop records of a logger above rate per interval
+
+    Errors always pass. Before the first record let through after
+    dropping some, a separate record notes how many were suppressed.
+    """
+
+    def __init__(self, rate: int, interval: float) -> None:
+        super().__init__()
+        self.rate = rate
+        self.interval = interval
+        self.window_start = 0.0
+        self.count = 0
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR or self.rate <= 0:
+            return True
+        now = time.monotonic()
+        if now - self.window_start >= self.interval:
+            self.window_start = now
+            self.count = 0
+        self.count += 1
+        if self.count > self.rate:
+            self.suppressed += 1
+            return False
+        if self.suppressed:
+            _queue.put_nowait(
+                logging.LogRecord(
+                    record.name,
+                    logging.WARNING,
+                    record.pathname,
+                    record.lineno,
+                    "%d messages suppressed by rate limit",
+                    (self.suppressed,),
+                    None,
+                )
+            )
+            self.suppressed = 0
+        return True
+
+
+def _make_handlers() -> list:
+    """Console and file handlers run by the listener thread"""
+    logging_config = config.logging
+    if logging_config.get("json", False):
+        file_formatter = JsonFormatter()
+    else:
+        file_formatter = logging.Formatter(
+            "%(asctime)s : %(levelname)s : %(name)s : %(message)s"
+        )
     console_formatter = ColoredFormatter(
         "%(log_color)s[%(levelname)s] %(name)s: %(message)s%(reset)s"
     )
 
     file_handler = RotatingFileHandler(
-        "logs/logfile.log", maxBytes=(1048576 * 5), backupCount=7, encoding="utf-8"
+        logging_config.get("file", "logs/logfile.log"),
+        maxBytes=(1048576 * 5),
+        backupCount=7,
+        encoding="utf-8",
     )
     file_handler.setLevel(logging.INFO)
     file_handler.setFormatter(file_formatter)
@@ -34,9 +106,46 @@ def get_logger(name):
     console_handler = logging.StreamHandler(stream=sys.stdout)
     console_handler.setLevel(logging.DEBUG)
     console_handler.setFormatter(console_formatter)
+    return [file_handler, console_handler]
+
+
+def _start_listener() -> None:
+    """Start the listener thread writing queued records once"""
+    global _listener  # pylint: disable=global-statement
+    with _listener_lock:
+        if _listener is None:
+            _listener = QueueListener(
+                _queue, *_make_handlers(), respect_handler_level=True
+            )
+            _listener.start()
+            atexit.register(stop_logging)
+
 
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+def stop_logging() -> None:
+    """Write all queued records and stop the listener thread"""
+    global _listener  # pylint: disable=global-statement
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_logger(name):
+    """Returns logger formated for both console and file"""
+    logger = logging.getLogger(name)
+    if logger.hasHandlers():
+        return logger
+
+    _start_listener()
+    logging_config = config.logging
+    queue_handler = QueueHandler(_queue)
+    queue_handler.addFilter(
+        RateLimitFilter(
+            logging_config.get("rate_limit", 100),
+            logging_config.get("rate_interval", 10),
+        )
+    )
+    logger.addHandler(queue_handler)
 
     logger.setLevel(logging.DEBUG if config.debug else logging.WARNING)
     return logger
@@ -0,0 +1,255 @@
+"""Metrics module
+
+Provides histograms for latency measurements shared across modules and
+a registry of labeled metrics exported in Prometheus text format."""
+import asyncio
+import bisect
+import os
+import threading
+import time
+from typing import Iterable, Optional, Union
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+class Histogram:
+    """Bucketed histogram of observed values
+
+    Observations may come from any thread, percentiles are estimated
+    by linear interpolation inside the bucket they fall into.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        description: str = "",
+        buckets: Iterable = DEFAULT_BUCKETS,
+        labels: Optional[dict] = None,
+    ) -> None:
+        """Init histogram with upper bounds of its buckets"""
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """Record an observed value"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self) -> tuple:
+        """Consistent copy of bucket counts, count and sum"""
+        with self._lock:
+            return list(self.counts), self.count, self.sum
+
+    @property
+    def mean(self) -> float:
+        """Mean of observed values"""
+        return self.sum / self.count if self.count else 0.0
+
+    def percentile(self, percent: float) -> float:
+        """Estimate the value below which given percent of observations fall"""
+        with self._lock:
+            counts = list(self.counts)
+            total = self.count
+        if total == 0:
+            return 0.0
+        rank = total * percent / 100
+        seen = 0
+        for index, count in enumerate(counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets):
+                    return lower
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def summary(self) -> str:
+        """Short human readable summary of the histogram in milliseconds"""
+        if self.count == 0:
+            return "no data"
+        return (
+            f"n={self.count} p50={self.percentile(50) * 1000:.0f}ms"
+            f" p95={self.percentile(95) * 1000:.0f}ms"
+        )
+
+    def prometheus(self) -> list:
+        """Sample lines in Prometheus text format"""
+        counts, count, total = self.snapshot()
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels({**self.labels, "le": repr(float(bound))})
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels({**self.labels, "le": "+Inf"})
+        lines.append(f"{self.name}_bucket{labels} {count}")
+        labels = _format_labels(self.labels)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Counter:
+    """Monotonically increasing count, may be increased from any thread"""
+
+    def __init__(
+        self, name: str, description: str = "", labels: Optional[dict] = None
+    ) -> None:
+        """Init counter at zero"""
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        """Increase counter"""
+        with self._lock:
+            self.value += amount
+
+    def prometheus(self) -> list:
+        """Sample lines in Prometheus text format"""
+        return [f"{self.name}{_format_labels(self.labels)} {self.value}"]
+
+
+Metric = Union[Histogram, Counter]
+
+
+def _format_labels(labels: dict) -> str:
+    """Format labels of a Prometheus sample"""
+    if not labels:
+        return ""
+    pairs = ",".join(
+        f'{key}="{_escape(str(value))}"' for key, value in sorted(labels.items())
+    )
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    """Escape label value for Prometheus text format"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registry:
+    """Metrics by name and labels
+
+    Metrics are created on first use and found again in constant time,
+    so hot paths can look them up on every observation.
+    """
+
+    def __init__(self) -> None:
+        """Init empty registry"""
+        self.started = time.monotonic()
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind: type, name: str, description: str, labels: dict, **kwargs):
+        """Get metric of kind by name and labels, creating it if needed"""
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = kind(name, description, labels=labels, **kwargs)
+                    self._metrics[key] = metric
+        return metric
+
+    def histogram(
+        self, name: str, description: str = "", buckets=DEFAULT_BUCKETS, **labels
+    ) -> Histogram:
+        """Get histogram of name and labels"""
+        return self._get(Histogram, name, description, labels, buckets=buckets)
+
+    def counter(self, name: str, description: str = "", **labels) -> Counter:
+        """Get counter of name and labels"""
+        return self._get(Counter, name, description, labels)
+
+    def metrics(self, name: Optional[str] = None) -> list:
+        """All metrics, or metrics of one name, sorted by name"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        if name is not None:
+            metrics = [metric for metric in metrics if metric.name == name]
+        return sorted(metrics, key=lambda metric: metric.name)
+
+    def prometheus(self) -> str:
+        """All metrics in Prometheus text format"""
+        lines = []
+        last_name = None
+        for metric in self.metrics():
+            if metric.name != last_name:
+                kind = "histogram" if isinstance(metric, Histogram) else "counter"
+                lines.append(f"# HELP {metric.name} {metric.description}")
+                lines.append(f"# TYPE {metric.name} {kind}")
+                last_name = metric.name
+            lines.extend(metric.prometheus())
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        """Atomically write all metrics to a file in Prometheus text format"""
+        data = self.prometheus()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as metrics_file:
+            metrics_file.write(data)
+        os.replace(tmp_path, path)
+
+    async def serve_prometheus(self, host: str, port: int) -> asyncio.AbstractServer:
+        """Serve all metrics over HTTP in Prometheus text format"""
+
+        async def handle(
+            reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+        ) -> None:
+            try:
+                await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+                body = self.prometheus().encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Type: text/plain; version=0.0.4\r\n"
+                    b"Content-Length: %d\r\n"
+                    b"Connection: close\r\n\r\n" % len(body) + body
+                )
+                await writer.drain()
+            except (
+                asyncio.TimeoutError,
+                asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError,
+                OSError,
+            ):
+                pass
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(handle, host, port)
+
+
+_registry = Registry()
+
+
+def get_registry() -> Registry:
+    """Returns registry of metrics"""
+    return _registry
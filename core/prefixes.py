@@ -0,0 +1,108 @@
+"""Command prefix module
+
+Resolves command prefixes of guilds from memory and persists prefix
+changes in the background."""
+import asyncio
+from typing import List, Optional
+
+from core.config import Config, get_config
+from core.storage import Storage, get_storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS guild_prefixes (
+    guild_id INTEGER PRIMARY KEY,
+    prefix TEXT NOT NULL
+);
+"""
+INSERT_PREFIX = "INSERT OR REPLACE INTO guild_prefixes (guild_id, prefix) VALUES (?, ?)"
+
+
+def _convert_prefixes(config_json: dict) -> list:
+    """Statements importing guild prefixes from the config file"""
+    prefixes = config_json.get("bot", {}).get("prefixes", {})
+    return [
+        (INSERT_PREFIX, (int(guild_id), prefix))
+        for guild_id, prefix in prefixes.items()
+    ]
+
+
+class PrefixResolver:
+    """Per guild command prefixes with cached prefix lists
+
+    Guilds without their own prefix use the default one implicitly, so
+    resolving never writes. Prefixes are loaded from storage once and
+    changes are saved in the background.
+    """
+
+    def __init__(self, config: Config, storage: Storage) -> None:
+        """Init resolver of prefixes kept in storage"""
+        self.config = config
+        self.storage = storage
+        self.prefixes = {}
+        self._lists = {}
+        self._loaded = None
+
+    async def load(self) -> None:
+        """Load guild prefixes once, importing them from the config file"""
+        if self._loaded is None:
+            self._loaded = asyncio.get_event_loop().create_task(self._load())
+        await self._loaded
+
+    async def _load(self) -> None:
+        """Read guild prefixes from storage"""
+        await self.storage.create_tables(SCHEMA)
+        if await self.storage.migrate(
+            "prefixes", "config/config.json", _convert_prefixes, rename=False
+        ):
+            self.config.clear_prefixes()
+            await asyncio.get_event_loop().run_in_executor(
+                None, self.config.write, self.config.dumps()
+            )
+        self.prefixes = dict(
+            await self.storage.fetch_all("SELECT guild_id, prefix FROM guild_prefixes")
+        )
+
+    def prefix(self, guild_id: Optional[int]) -> str:
+        """Get prefix of guild, the default one outside of guilds"""
+        return self.prefixes.get(guild_id, self.config.default_prefix)
+
+    async def resolve(self, bot, message) -> List[str]:
+        """Get mentions of the bot and prefix of the message guild"""
+        guild_id = message.guild.id if message.guild else None
+        prefixes = self._lists.get(guild_id)
+        if prefixes is None:
+            await self.load()
+            prefixes = [
+                f"<@{bot.user.id}> ",
+                f"<@!{bot.user.id}> ",
+                self.prefix(guild_id),
+            ]
+            self._lists[guild_id] = prefixes
+        return prefixes
+
+    def set_prefix(self, guild_id: int, prefix: str) -> None:
+        """Set prefix of guild and save it soon"""
+        if prefix == self.config.default_prefix:
+            self.prefixes.pop(guild_id, None)
+            self.storage.execute(
+                "DELETE FROM guild_prefixes WHERE guild_id = ?", (guild_id,)
+            )
+        else:
+            self.prefixes[guild_id] = prefix
+            self.storage.execute(INSERT_PREFIX, (guild_id, prefix))
+        self._lists.pop(guild_id, None)
+
+    def clear(self) -> None:
+        """Forget cached prefix lists, after the config was reloaded"""
+        self._lists.clear()
+
+
+_resolver = None
+
+
+def get_prefix_resolver() -> PrefixResolver:
+    """Returns prefix resolver of the config"""
+    global _resolver  # pylint: disable=global-statement
+    if _resolver is None:
+        _resolver = PrefixResolver(get_config(), get_storage())
+    return _resolver
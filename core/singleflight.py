@@ -0,0 +1,57 @@
+"""Singleflight module
+
+Provides coalescing of concurrent identical operations, so callers
+asking for the same key at once share a single call."""
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+from core.metrics import get_registry
+
+
+class SingleFlight:
+    """Group of operations coalesced by key
+
+    The first caller of a key starts the operation as a task, callers
+    arriving while it runs await the same task and get its result or
+    exception. Cancelling a caller does not cancel the shared task.
+    Calls and coalesced calls are counted per group name.
+    """
+
+    def __init__(self, name: str) -> None:
+        """Init group with name used in metrics"""
+        self.name = name
+        self._calls = {}
+        registry = get_registry()
+        self._total = registry.counter(
+            "coco_singleflight_calls_total", "Singleflight calls", group=name
+        )
+        self._coalesced = registry.counter(
+            "coco_singleflight_coalesced_total",
+            "Singleflight calls sharing an operation already in flight",
+            group=name,
+        )
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(
+        self, key: Hashable, func: Callable[..., Awaitable], *args, **kwargs
+    ) -> Any:
+        """Await func called with args, or the call of key already in flight"""
+        self._total.inc()
+        task = self._calls.get(key)
+        if task is not None:
+            self._coalesced.inc()
+        else:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Future) -> None:
+        """Remove finished task so the next call of key starts a new one"""
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Retrieved so it is not reported when every caller was cancelled
+            task.exception()
@@ -0,0 +1,181 @@
+"""Storage module
+
+Provides a SQLite database shared by all cogs for their persistent state.
+Writes are queued and committed in batches by a background task."""
+import asyncio
+import json
+import os
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+import aiosqlite
+
+from core.config import get_config
+from core.logger import get_logger
+
+# Statement with its parameters, as queued for the writer
+Write = Tuple[str, Iterable[Any]]
+
+logger = get_logger(__name__)
+
+
+class Storage:
+    """SQLite database in WAL mode with batched writes
+
+    Cogs create their own typed tables and keep their state in memory,
+    reading it once on load. Every change queues only the statements it
+    needs, the writer commits all statements queued within the batch
+    delay in one transaction. Existing JSON files are migrated once.
+    """
+
+    def __init__(self, path: str, batch_delay: float = 0.5) -> None:
+        """Init storage of database at path"""
+        self.path = path
+        self.batch_delay = batch_delay
+        self.commits = 0
+        self.writes = 0
+        self._db = None
+        self._connect_lock = asyncio.Lock()
+        self._commit_lock = asyncio.Lock()
+        self._pending = []
+        self._writer = None
+
+    async def connect(self) -> aiosqlite.Connection:
+        """Open database on first use"""
+        async with self._connect_lock:
+            if self._db is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                db = await aiosqlite.connect(self.path)
+                await db.execute("PRAGMA journal_mode=WAL")
+                await db.execute("PRAGMA synchronous=NORMAL")
+                await db.execute(
+                    "CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY)"
+                )
+                await db.commit()
+                self._db = db
+        return self._db
+
+    async def create_tables(self, schema: str) -> None:
+        """Create tables of a cog from its schema script"""
+        db = await self.connect()
+        await db.executescript(schema)
+
+    async def fetch_all(self, sql: str, params: Iterable[Any] = ()) -> List[tuple]:
+        """Run query and return all rows"""
+        db = await self.connect()
+        async with db.execute(sql, params) as cursor:
+            return await cursor.fetchall()
+
+    def execute(self, sql: str, params: Iterable[Any] = ()) -> None:
+        """Queue statement to be committed with the next batch"""
+        self._pending.append((sql, params))
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.get_event_loop().create_task(self._write())
+
+    async def _write(self) -> None:
+        """Commit queued statements in batches until none are left"""
+        while self._pending:
+            await asyncio.sleep(self.batch_delay)
+            batch, self._pending = self._pending, []
+            await self._commit_batch(batch)
+
+    async def _commit_batch(self, batch: List[Write]) -> None:
+        """Commit queued statements, one by one if the batch fails
+
+        A failing statement is logged and dropped, so it does not take
+        unrelated writes queued with it down too.
+        """
+        try:
+            await self._commit(batch)
+            return
+        except aiosqlite.Error as err:
+            logger.warning(
+                "Batch of %d statements failed (%s), committing one by one",
+                len(batch),
+                err,
+            )
+        for sql, params in batch:
+            try:
+                await self._commit([(sql, params)])
+            except aiosqlite.Error as err:
+                logger.error("Dropped statement %s with %r: %s", sql, params, err)
+
+    async def _commit(self, batch: List[Write]) -> None:
+        """Run statements in one transaction"""
+        db = await self.connect()
+        async with self._commit_lock:
+            try:
+                for sql, params in batch:
+                    await db.execute(sql, params)
+                await db.commit()
+            except aiosqlite.Error:
+                await db.rollback()
+                raise
+        self.commits += 1
+        self.writes += len(batch)
+
+    async def flush(self) -> None:
+        """Wait until all queued statements are committed"""
+        if self._writer is not None and not self._writer.done():
+            await self._writer
+
+    async def migrate(
+        self,
+        name: str,
+        path: str,
+        convert: Callable[[Any], List[Write]],
+        rename: bool = True,
+    ) -> bool:
+        """Import JSON file at path once, returns whether it was imported
+
+        Convert turns the parsed JSON into statements, which are committed
+        together with the migration mark. The file is kept, renamed unless
+        other state still lives in it.
+        """
+        db = await self.connect()
+        async with db.execute(
+            "SELECT 1 FROM migrations WHERE name = ?", (name,)
+        ) as cursor:
+            if await cursor.fetchone() is not None:
+                return False
+        loop = asyncio.get_event_loop()
+        data = await loop.run_in_executor(None, _read_json, path)
+        batch = convert(data) if data is not None else []
+        batch.append(("INSERT INTO migrations (name) VALUES (?)", (name,)))
+        await self._commit(batch)
+        if data is not None and rename:
+            await loop.run_in_executor(None, os.replace, path, f"{path}.migrated")
+        return data is not None
+
+    async def close(self) -> None:
+        """Commit queued statements and close database"""
+        await self.flush()
+        if self._pending:
+            batch, self._pending = self._pending, []
+            await self._commit_batch(batch)
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+
+def _read_json(path: str) -> Optional[Any]:
+    """Read JSON file, None if there is none"""
+    try:
+        with open(path, "r", encoding="utf-8") as json_file:
+            return json.load(json_file)
+    except FileNotFoundError:
+        return None
+
+
+_storage = None
+
+
+def get_storage() -> Storage:
+    """Returns storage configured from the storage config"""
+    global _storage  # pylint: disable=global-statement
+    if _storage is None:
+        storage_config = get_config().storage
+        _storage = Storage(
+            storage_config.get("path", "data/coco.db"),
+            batch_delay=storage_config.get("batch_delay", 0.5),
+        )
+    return _storage
@@ -0,0 +1,153 @@
+"""Watchdog module
+
+Measures event loop lag and finds the code that blocks the loop."""
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque, namedtuple
+from typing import Optional, Tuple
+
+from discord.ext import commands
+
+from core.config import get_config
+from core.logger import get_logger
+from core.metrics import get_registry
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Stall of the event loop as seen by the watchdog thread
+Stall = namedtuple("Stall", ("at", "seconds", "cog", "command", "location"))
+
+logger = get_logger(__name__)
+
+
+def _find_command(frame) -> Tuple[Optional[str], Optional[str]]:
+    """Find cog and command whose code the frame belongs to"""
+    cog = command = None
+    while frame is not None and (cog is None or command is None):
+        local_vars = frame.f_locals
+        owner = local_vars.get("self")
+        if cog is None and isinstance(owner, commands.Cog):
+            cog = owner.qualified_name
+        ctx = local_vars.get("ctx")
+        if command is None and isinstance(ctx, commands.Context) and ctx.command:
+            command = ctx.command.qualified_name
+        frame = frame.f_back
+    return cog, command
+
+
+class LoopWatchdog:
+    """Event loop lag meter with a thread sampling the loop when it stalls
+
+    A task on the loop beats every interval and records how late it woke
+    up. A thread checks the beats, when none came for longer than the
+    threshold it samples the stack of the loop thread once per stall and
+    logs where the loop is blocked.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        interval: float = 0.25,
+        threshold: float = 0.5,
+        stack_depth: int = 15,
+    ) -> None:
+        """Init watchdog of loop"""
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self.stack_depth = stack_depth
+        self.lag = get_registry().histogram(
+            "coco_loop_lag_seconds", "Event loop lag", buckets=LAG_BUCKETS
+        )
+        self.stalls = deque(maxlen=10)
+        self._beat = time.monotonic()
+        self._reported_beat = None
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """Start beating on the loop and watching from a thread"""
+        self._task = self.loop.create_task(self._heartbeat())
+        self._thread = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop watching"""
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _heartbeat(self) -> None:
+        """Beat every interval, recording how late each beat is"""
+        self._loop_thread_id = threading.get_ident()
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.lag.observe(max(time.monotonic() - self._beat - self.interval, 0.0))
+
+    def _watch(self) -> None:
+        """Report stalls of the loop, runs in the watchdog thread"""
+        while not self._stopped.wait(self.interval / 2):
+            beat = self._beat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled >= self.threshold and beat != self._reported_beat:
+                self._reported_beat = beat
+                self._report(stalled)
+
+    def _report(self, stalled: float) -> None:
+        """Sample stack of the loop thread and log where it is blocked"""
+        frame = sys._current_frames().get(  # pylint: disable=protected-access
+            self._loop_thread_id
+        )
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)[-self.stack_depth :]
+        cog, command = _find_command(frame)
+        del frame
+        location = f"{stack[-1].filename}:{stack[-1].lineno}" if stack else "unknown"
+        self.stalls.append(Stall(time.time(), stalled, cog, command, location))
+        get_registry().counter(
+            "coco_loop_stalls_total",
+            "Event loop stalls longer than the watchdog threshold",
+            cog=cog or "none",
+        ).inc()
+        logger.warning(
+            "Event loop blocked for over %.2f seconds in cog %s, command %s:\n%s",
+            stalled,
+            cog,
+            command,
+            "".join(traceback.format_list(stack)),
+        )
+
+
+_watchdog = None
+
+
+def start_watchdog(loop: asyncio.AbstractEventLoop) -> LoopWatchdog:
+    """Start watchdog configured from the watchdog config, once"""
+    global _watchdog  # pylint: disable=global-statement
+    if _watchdog is None:
+        watchdog_config = get_config().watchdog
+        _watchdog = LoopWatchdog(
+            loop,
+            interval=watchdog_config.get("interval", 0.25),
+            threshold=watchdog_config.get("threshold", 0.5),
+            stack_depth=watchdog_config.get("stack_depth", 15),
+        )
+        _watchdog.start()
+    return _watchdog
+
+
+def stop_watchdog() -> None:
+    """Stop watchdog, a new one is started on next use"""
+    global _watchdog  # pylint: disable=global-statement
+    if _watchdog is not None:
+        _watchdog.stop()
+        _watchdog = None
@@ -1,11 +1,18 @@
 """Base bot commands cog module"""
 import os
 import sys
+import time
 from datetime import datetime
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from core.basecog import BaseCog
+from core.http import close_http_client
+from core.logger import stop_logging
+from core.metrics import get_registry
+from core.prefixes import get_prefix_resolver
+from core.storage import get_storage
+from core.watchdog import start_watchdog, stop_watchdog
 
 
 def _make_embed(title, description=None, color=0xFFFF00) -> discord.Embed:
@@ -23,6 +30,54 @@ class Base(BaseCog):
         """Base class init with time of boot."""
         super().__init__(bot)
         self.time_of_boot = datetime.now().replace(microsecond=0)
+        self.watchdog = start_watchdog(self.bot.loop)
+        self.metrics_server = None
+        metrics_config = self.config.metrics
+        if metrics_config.get("prometheus_file"):
+            self.export_metrics.change_interval(
+                seconds=metrics_config.get("export_interval", 15)
+            )
+            self.export_metrics.start()
+        if metrics_config.get("prometheus_port"):
+            self.bot.loop.create_task(
+                self._serve_metrics(
+                    metrics_config.get("prometheus_host", "127.0.0.1"),
+                    metrics_config["prometheus_port"],
+                )
+            )
+
+    def cog_unload(self) -> None:
+        """Stop exporting metrics and watching the event loop on unload"""
+        stop_watchdog()
+        self.export_metrics.cancel()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+
+    async def _serve_metrics(self, host: str, port: int) -> None:
+        """Serve metrics over HTTP for Prometheus"""
+        try:
+            self.metrics_server = await get_registry().serve_prometheus(host, port)
+        except OSError as err:
+            self.logger.error("Failed to serve metrics on %s:%s: %s", host, port, err)
+            return
+        self.logger.info("Serving metrics on %s:%s", host, port)
+
+    @tasks.loop(seconds=15)
+    async def export_metrics(self) -> None:
+        """Write metrics to file for Prometheus"""
+        await self.bot.loop.run_in_executor(
+            None,
+            get_registry().write_prometheus,
+            self.config.metrics["prometheus_file"],
+        )
+
+    def _unload_extensions(self) -> None:
+        """Unload all extensions so they can save their state"""
+        for extension in list(self.bot.extensions):
+            try:
+                self.bot.unload_extension(extension)
+            except Exception as err:
+                self.logger.error("Failed to unload extension %s: %s", extension, err)
 
     @commands.Cog.listener()
     async def on_message(self, ctx: commands.Context) -> None:
@@ -115,6 +170,9 @@ class Base(BaseCog):
         embed = _make_embed("Shutting down...")
         embed.add_field(name="Uptime", value=str(delta))
         await ctx.send(embed=embed)
+        self._unload_extensions()
+        await get_storage().close()
+        await close_http_client()
         await self.bot.close()
         sys.exit(0)
 
@@ -128,9 +186,62 @@ class Base(BaseCog):
         embed.add_field(name="Uptime", value=str(delta))
         await ctx.send(embed=embed)
         await self.bot.change_presence(activity=discord.Game(name="Restarting..."))
+        self._unload_extensions()
+        await get_storage().close()
+        await close_http_client()
+        await self.bot.close()
+        stop_logging()
         sys.stdout.flush()
         os.execv(sys.executable, ["python"] + sys.argv)
 
+    @commands.is_owner()
+    @commands.command()
+    async def stats(self, ctx: commands.Context) -> None:
+        """Show latency, rate and errors of the most used commands"""
+        registry = get_registry()
+        minutes = max((time.monotonic() - registry.started) / 60, 1 / 60)
+        errors = {
+            (counter.labels["cog"], counter.labels["command"]): counter.value
+            for counter in registry.metrics("coco_command_errors_total")
+        }
+        histograms = sorted(
+            registry.metrics("coco_command_seconds"),
+            key=lambda histogram: histogram.count,
+            reverse=True,
+        )
+        lines = []
+        for histogram in histograms[:20]:
+            cog, command = histogram.labels["cog"], histogram.labels["command"]
+            lines.append(
+                f"`{command}` ({cog}): {histogram.count} calls,"
+                f" {histogram.count / minutes:.2f}/min,"
+                f" {errors.get((cog, command), 0)} errors\n"
+                f"p50 {histogram.percentile(50) * 1000:.0f}ms"
+                f" p95 {histogram.percentile(95) * 1000:.0f}ms"
+                f" p99 {histogram.percentile(99) * 1000:.0f}ms"
+            )
+        embed = _make_embed(
+            "Command stats", "\n".join(lines) if lines else "No commands yet."
+        )
+        lag = self.watchdog.lag
+        embed.add_field(
+            name="Event loop lag",
+            value=(
+                f"p50 {lag.percentile(50) * 1000:.0f}ms"
+                f" p99 {lag.percentile(99) * 1000:.0f}ms"
+            ),
+        )
+        if self.watchdog.stalls:
+            stall = self.watchdog.stalls[-1]
+            embed.add_field(
+                name="Last stall",
+                value=(
+                    f"{stall.seconds:.2f}s in {stall.cog or 'no cog'}"
+                    f" {stall.command or ''}\n`{stall.location}`"
+                ),
+            )
+        await ctx.send(embed=embed)
+
     @commands.command()
     async def reload_config(self, ctx: commands.Context) -> None:
         """Bot command used for reloading config on the go.
@@ -140,5 +251,6 @@ class Base(BaseCog):
         Outputs successfull reload to channel, where command was invoked.
         """
         self.config.reload()
+        get_prefix_resolver().clear()
         await ctx.send("🔁 Config reloaded.", delete_after=10)
         await ctx.message.delete(delay=10)
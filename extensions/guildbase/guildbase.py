@@ -1,6 +1,7 @@
 """Guildbase bot commands cog module"""
 from discord.ext import commands
 from core.basecog import BaseCog
+from core.prefixes import get_prefix_resolver
 
 
 class GuildBase(BaseCog):
@@ -25,6 +26,5 @@ class GuildBase(BaseCog):
         if new_prefix == "":
             await ctx.send("Prefix can't be empty!")
             return
-        self.config.prefixes[str(ctx.guild.id)] = new_prefix
-        self.config.save()
+        get_prefix_resolver().set_prefix(ctx.guild.id, new_prefix)
         await ctx.send(f"Prefix set to `{new_prefix}`")
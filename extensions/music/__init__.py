@@ -1,10 +1,12 @@
 """Music bot import module"""
 from .music import Music
+from .musicstats import MusicStats
 
 
 def setup(bot) -> None:
     """Setup function used by discord.py extension loader.
 
-    Adds Music cog to bot.
+    Adds Music and MusicStats cogs to bot.
     """
     bot.add_cog(Music(bot))
+    bot.add_cog(MusicStats(bot))
@@ -0,0 +1,271 @@
+"""Module with on-disk Opus cache of frequently played songs for music cog"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict
+from typing import Optional
+
+from core.cache import TTLCache
+from core.config import get_config
+from core.logger import get_logger
+
+from .track import Track
+
+logger = get_logger(__name__)
+
+# Cache keys are sha1 hex digests of song urls
+KEY_PATTERN = re.compile(r"[0-9a-f]{40}")
+
+
+class AudioCache:
+    """Size-capped LRU cache of songs transcoded to Ogg Opus files
+
+    Songs are transcoded in the background once they were played a few
+    times. Files are encoded at the default player volume, so at that
+    volume they can be sent to discord without decoding. Track metadata
+    of each song is kept next to its file, so songs played from the cache
+    show it without being resolved.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        min_plays: int,
+        max_duration: int,
+        volume: float,
+        bitrate: int = 128,
+    ) -> None:
+        """Init audio cache and index files already present in directory"""
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_plays = min_plays
+        self.max_duration = max_duration
+        self.volume = volume
+        self.bitrate = bitrate
+
+        self.hits = 0
+        self.misses = 0
+        self.total_bytes = 0
+        self._files = OrderedDict()
+        self._tracks = {}
+        self._plays = TTLCache(maxsize=4096, ttl=7 * 24 * 3600)
+        self._transcodes = {}
+        self.pids = set()
+        self._transcode_slot = asyncio.Semaphore(1)
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    @staticmethod
+    def key(url: str) -> str:
+        """Cache key of a song webpage url"""
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        """Path of cached file"""
+        return os.path.join(self.directory, key + ".opus")
+
+    def _track_path(self, key: str) -> str:
+        """Path of track metadata of cached file"""
+        return os.path.join(self.directory, key + ".json")
+
+    def _read_track(self, key: str) -> Optional[Track]:
+        """Read track metadata of cached file, None if it has none"""
+        try:
+            with open(self._track_path(key), encoding="utf-8") as file:
+                return Track.from_list(json.load(file))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def _write_track(self, key: str, track: Track) -> None:
+        """Write track metadata of cached file atomically"""
+        tmp_path = self._track_path(key) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(track.to_list(), file, separators=(",", ":"))
+        os.replace(tmp_path, self._track_path(key))
+
+    def _remove(self, key: str) -> None:
+        """Remove cached file and its track metadata"""
+        self._tracks.pop(key, None)
+        for path in (self._path(key), self._track_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _load_index(self) -> None:
+        """Index cached files from least to most recently used
+
+        Only files named by a cache key are touched, others are left alone.
+        """
+        entries = []
+        track_keys = set()
+        for entry in os.scandir(self.directory):
+            key, _, extension = entry.name.partition(".")
+            if not KEY_PATTERN.fullmatch(key):
+                continue
+            if extension.endswith("tmp"):
+                os.remove(entry.path)
+            elif extension == "opus":
+                stat = entry.stat()
+                entries.append((stat.st_mtime, key, stat.st_size))
+            elif extension == "json":
+                track_keys.add(key)
+        for _, key, size in sorted(entries):
+            self._files[key] = size
+            self.total_bytes += size
+            track = self._read_track(key) if key in track_keys else None
+            if track is not None:
+                self._tracks[key] = track
+        for key in track_keys.difference(self._files):
+            os.remove(self._track_path(key))
+        self._evict()
+
+    def _evict(self) -> None:
+        """Remove least recently used files until the cache fits its budget"""
+        while self.total_bytes > self.max_bytes and self._files:
+            key, size = self._files.popitem(last=False)
+            self.total_bytes -= size
+            self._remove(key)
+
+    def lookup(self, url: str) -> Optional[str]:
+        """Get path of cached song file and mark it as recently used"""
+        key = self.key(url)
+        if key not in self._files:
+            self.misses += 1
+            return None
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.total_bytes -= self._files.pop(key)
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._files.move_to_end(key)
+        self.hits += 1
+        return path
+
+    def track(self, url: str) -> Optional[Track]:
+        """Get track metadata of cached song, None if it was not kept"""
+        return self._tracks.get(self.key(url))
+
+    def note_play(self, song) -> None:
+        """Count a streamed play of song and cache it once played often enough"""
+        key = self.key(song.url)
+        plays = self._plays.get(key, 0) + 1
+        self._plays.set(key, plays)
+        if (
+            plays >= self.min_plays
+            and key not in self._files
+            and key not in self._transcodes
+            and 0 < song.duration <= self.max_duration
+            and song.stream_url
+        ):
+            self._transcodes[key] = asyncio.get_event_loop().create_task(
+                self._transcode(key, song.stream_url, song.track)
+            )
+
+    @property
+    def transcoding(self) -> int:
+        """Number of songs waiting for or being transcoded"""
+        return len(self._transcodes)
+
+    async def _transcode(self, key: str, stream_url: str, track: Track) -> None:
+        """Transcode stream to Ogg Opus and add the file with its track to cache"""
+        tmp_path = self._path(key) + ".tmp"
+        process = None
+        try:
+            async with self._transcode_slot:
+                process = await asyncio.create_subprocess_exec(
+                    "ffmpeg",
+                    "-reconnect",
+                    "1",
+                    "-reconnect_streamed",
+                    "1",
+                    "-reconnect_delay_max",
+                    "5",
+                    "-i",
+                    stream_url,
+                    "-vn",
+                    "-map_metadata",
+                    "-1",
+                    "-af",
+                    f"volume={self.volume}",
+                    "-c:a",
+                    "libopus",
+                    "-b:a",
+                    f"{self.bitrate}k",
+                    "-frame_duration",
+                    "20",
+                    "-ar",
+                    "48000",
+                    "-ac",
+                    "2",
+                    "-f",
+                    "ogg",
+                    "-loglevel",
+                    "error",
+                    "-y",
+                    tmp_path,
+                    stdin=asyncio.subprocess.DEVNULL,
+                )
+                self.pids.add(process.pid)
+                if await process.wait() != 0:
+                    logger.warning("Transcoding %s for cache failed", key)
+                    return
+            os.replace(tmp_path, self._path(key))
+            self._write_track(key, track)
+            self._tracks[key] = track
+            size = os.path.getsize(self._path(key))
+            self._files[key] = size
+            self.total_bytes += size
+            self._evict()
+        except asyncio.CancelledError:
+            if process is not None and process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        finally:
+            self._transcodes.pop(key, None)
+            if process is not None:
+                self.pids.discard(process.pid)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def close(self) -> None:
+        """Cancel running transcodes"""
+        for task in list(self._transcodes.values()):
+            task.cancel()
+
+
+_cache = None
+
+
+def get_audio_cache() -> AudioCache:
+    """Returns audio cache configured from the music config"""
+    global _cache  # pylint: disable=global-statement
+    if _cache is None:
+        music_config = get_config().music
+        _cache = AudioCache(
+            music_config.get("cache_dir", "cache/music"),
+            max_bytes=music_config.get("cache_max_mb", 1024) * 1024 * 1024,
+            min_plays=music_config.get("cache_min_plays", 2),
+            max_duration=music_config.get("cache_max_duration", 900),
+            volume=music_config.get("default_volume", 0.5),
+        )
+    return _cache
+
+
+def close_audio_cache() -> None:
+    """Cancel transcodes of audio cache, a new one is created on next use"""
+    global _cache  # pylint: disable=global-statement
+    if _cache is not None:
+        _cache.close()
+        _cache = None
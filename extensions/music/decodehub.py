@@ -0,0 +1,119 @@
+"""Module with shared ffmpeg decoders fanned out to many guilds for music cog"""
+import asyncio
+import threading
+from collections import deque
+from typing import Hashable, Optional, Tuple
+
+import discord
+
+# Frames of 20 ms sent while a lagging subscriber waits for its own stream
+OPUS_SILENCE = b"\xf8\xff\xfe"
+PCM_SILENCE = b"\x00" * discord.opus.Encoder.FRAME_SIZE
+
+# Hubs new subscribers of a key join, and all hubs still playing
+_hubs = {}
+_live = set()
+_hubs_lock = threading.Lock()
+
+
+class DecodeHub:
+    """One ffmpeg process whose frames are read by several subscribers
+
+    Frames are kept in a ring buffer and read by index, the subscriber
+    furthest ahead pulls new frames from ffmpeg. Subscribers falling
+    further behind than the buffer get None and must catch up. The
+    process is killed when the last subscriber leaves.
+    """
+
+    def __init__(
+        self, key: Hashable, source: discord.AudioSource, buffer: int, join_window: int
+    ) -> None:
+        """Init hub reading source, with buffer and join window in frames"""
+        self.key = key
+        self.source = source
+        self.join_window = join_window
+        self.lease = None
+        self.subscribers = 1
+        self.base = 0
+        self._frames = deque(maxlen=buffer)
+        self.eof = False
+        self._lock = threading.Lock()
+        self._loop = asyncio.get_event_loop()
+
+    @property
+    def head(self) -> int:
+        """Index of the next frame to be read from ffmpeg"""
+        return self.base + len(self._frames)
+
+    @property
+    def pid(self) -> Optional[int]:
+        """Pid of the ffmpeg process"""
+        process = getattr(self.source, "_process", None)
+        return process.pid if process else None
+
+    def is_opus(self) -> bool:
+        """Check if frames are Opus packets rather than PCM"""
+        return self.source.is_opus()
+
+    @property
+    def silence(self) -> bytes:
+        """Frame of silence in the format of this hub"""
+        return OPUS_SILENCE if self.is_opus() else PCM_SILENCE
+
+    def read(self, index: int) -> Optional[bytes]:
+        """Read frame at index, empty at the end and None if already dropped"""
+        with self._lock:
+            if index < self.base:
+                return None
+            if index < self.head:
+                return self._frames[index - self.base]
+            if self.eof:
+                return b""
+            data = self.source.read()
+            if not data:
+                self.eof = True
+                return b""
+            if len(self._frames) == self._frames.maxlen:
+                self.base += 1
+            self._frames.append(data)
+            return data
+
+    def unsubscribe(self) -> None:
+        """Leave hub, the last subscriber closes it"""
+        with _hubs_lock:
+            self.subscribers -= 1
+            if self.subscribers > 0:
+                return
+            if _hubs.get(self.key) is self:
+                del _hubs[self.key]
+            _live.discard(self)
+        self.source.cleanup()
+        if self.lease is not None:
+            self._loop.call_soon_threadsafe(self.lease.release)
+
+
+def join_hub(key: Hashable) -> Optional[DecodeHub]:
+    """Subscribe to the hub of key if it is still at the start of its stream"""
+    with _hubs_lock:
+        hub = _hubs.get(key)
+        if hub is None or hub.base > 0 or hub.head > hub.join_window or hub.eof:
+            return None
+        hub.subscribers += 1
+        return hub
+
+
+def open_hub(
+    key: Hashable, source: discord.AudioSource, buffer: int, join_window: int
+) -> DecodeHub:
+    """Create hub reading source, new subscribers of key will join it"""
+    hub = DecodeHub(key, source, buffer, join_window)
+    with _hubs_lock:
+        _hubs[key] = hub
+        _live.add(hub)
+    return hub
+
+
+def hub_stats() -> Tuple[int, int]:
+    """Number of live hubs and their subscribers"""
+    with _hubs_lock:
+        return len(_live), sum(hub.subscribers for hub in _live)
@@ -0,0 +1,156 @@
+"""Module with process pool for yt-dlp extraction of music cog"""
+import asyncio
+import functools
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Hashable
+
+from core.config import get_config
+from core.metrics import get_registry
+
+from . import extractor
+from .extractor import ExtractionError
+
+
+class ExtractionPool:
+    """Process pool running yt-dlp extraction away from the event loop
+
+    Requests wait in a bounded queue and are started round-robin
+    across guilds, so one guild queuing many songs can't starve others.
+    """
+
+    def __init__(
+        self, options: dict, workers: int, max_pending: int, timeout: float
+    ) -> None:
+        """Init extraction pool, worker processes are started on first use"""
+        self.options = options
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+
+        self.pending = 0
+        self.running = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.queue_wait = get_registry().histogram(
+            "coco_music_extraction_queue_wait_seconds",
+            "Time extraction requests wait for a free worker",
+        )
+        self.latency = get_registry().histogram(
+            "coco_music_extraction_seconds", "Time of yt-dlp extractions in workers"
+        )
+
+        self._executor = None
+        self._queues = OrderedDict()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Get process pool executor, creating it if needed"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=extractor.init_worker,
+                initargs=(self.options,),
+            )
+        return self._executor
+
+    def start(self) -> None:
+        """Start worker processes ahead of the first request"""
+        self._get_executor().submit(extractor.ping)
+
+    async def run(self, guild_id: Hashable, func: Callable, *args) -> Any:
+        """Run extraction function in the pool on behalf of a guild"""
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise ExtractionError(
+                "Too many songs are being looked up right now, try again later."
+            )
+        future = asyncio.get_event_loop().create_future()
+        self._queues.setdefault(guild_id, deque()).append(
+            (future, func, args, time.monotonic())
+        )
+        self.pending += 1
+        self._dispatch()
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError as err:
+            self.timeouts += 1
+            future.cancel()
+            raise ExtractionError("Looking up the song took too long.") from err
+        except asyncio.CancelledError:
+            # Queued jobs of cancelled callers are skipped by dispatch
+            future.cancel()
+            raise
+
+    def _dispatch(self) -> None:
+        """Start queued jobs while there are free workers"""
+        loop = asyncio.get_event_loop()
+        while self.running < self.workers and self._queues:
+            guild_id, jobs = next(iter(self._queues.items()))
+            future, func, args, queued_at = jobs.popleft()
+            if jobs:
+                self._queues.move_to_end(guild_id)
+            else:
+                del self._queues[guild_id]
+            self.pending -= 1
+            if future.done():
+                continue
+            started_at = time.monotonic()
+            self.queue_wait.observe(started_at - queued_at)
+            self.running += 1
+            job = loop.run_in_executor(self._get_executor(), func, *args)
+            job.add_done_callback(functools.partial(self._finish, future, started_at))
+
+    def _finish(
+        self, future: asyncio.Future, started_at: float, job: asyncio.Future
+    ) -> None:
+        """Pass result of finished job to its waiter and start next job"""
+        self.running -= 1
+        self.latency.observe(time.monotonic() - started_at)
+        if job.cancelled():
+            future.cancel()
+        elif job.exception() is not None:
+            if isinstance(job.exception(), BrokenProcessPool):
+                self._executor = None
+            if not future.done():
+                future.set_exception(job.exception())
+        elif not future.done():
+            future.set_result(job.result())
+        self._dispatch()
+
+    def shutdown(self) -> None:
+        """Cancel queued requests and stop worker processes"""
+        for jobs in self._queues.values():
+            for future, *_ in jobs:
+                future.cancel()
+        self._queues.clear()
+        self.pending = 0
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+_pool = None
+
+
+def get_extraction_pool() -> ExtractionPool:
+    """Returns extraction pool configured from the music config"""
+    global _pool  # pylint: disable=global-statement
+    if _pool is None:
+        music_config = get_config().music
+        _pool = ExtractionPool(
+            extractor.YTDL_OPTIONS,
+            workers=music_config.get("extraction_workers", 2),
+            max_pending=music_config.get("extraction_queue_size", 32),
+            timeout=music_config.get("extraction_timeout", 30),
+        )
+    return _pool
+
+
+def shutdown_extraction_pool() -> None:
+    """Shut down extraction pool, a new one is created on next use"""
+    global _pool  # pylint: disable=global-statement
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
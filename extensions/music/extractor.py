@@ -0,0 +1,127 @@
+"""Module with yt-dlp extraction functions executed in extraction worker processes
+
+Functions here return only small picklable values, results are sent
+back to the bot process.
+"""
+import functools
+import itertools
+from typing import Optional, Union
+
+import yt_dlp
+
+yt_dlp.utils.bug_reports_message = lambda: ""
+
+YTDL_OPTIONS = {
+    "format": "bestaudio/best",
+    "extractaudio": True,
+    "audioformat": "mp3",
+    "outtmpl": "%(extractor)s-%(id)s-%(title)s.%(ext)s",
+    "restrictfilenames": True,
+    "noplaylist": True,
+    "nocheckcertificate": True,
+    "ignoreerrors": False,
+    "logtostderr": False,
+    "quiet": True,
+    "no_warnings": True,
+    "default_search": "auto",
+}
+
+_ytdl = None
+
+
+class ExtractionError(Exception):
+    """Exception for failed, rejected or timed out extraction requests"""
+
+
+def _picklable_errors(func):
+    """Re-raise errors of func as ExtractionError
+
+    yt-dlp errors carry tracebacks in exc_info, which cannot be pickled
+    back to the bot process.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        try:
+            return func(*args)
+        except Exception as err:
+            raise ExtractionError(str(err)) from None
+
+    return wrapper
+
+
+def init_worker(options: dict) -> None:
+    """Create the yt-dlp instance of a worker process"""
+    global _ytdl  # pylint: disable=global-statement
+    _ytdl = yt_dlp.YoutubeDL(options)
+    _ytdl.cache.remove()
+
+
+def ping() -> bool:
+    """No-op used to start worker processes ahead of the first request"""
+    return True
+
+
+def _entry_url(entry: dict) -> Optional[str]:
+    """Get webpage url of an unresolved playlist entry"""
+    url = entry.get("webpage_url") or entry.get("url")
+    if url and not url.startswith(("http://", "https://")):
+        if entry.get("ie_key") != "Youtube":
+            return None
+        url = f"https://www.youtube.com/watch?v={entry.get('id') or url}"
+    return url
+
+
+def _playlist(data: dict, limit: int) -> dict:
+    """Compact unresolved playlist entries to (url, title, duration) tuples"""
+    entries = data["entries"]
+    if hasattr(entries, "getslice"):
+        entries = entries.getslice(0, limit)
+    compact = []
+    for entry in itertools.islice(entries, limit):
+        url = _entry_url(entry) if entry else None
+        if url:
+            compact.append((url, entry.get("title"), entry.get("duration")))
+    return {"title": data.get("title"), "entries": compact}
+
+
+@_picklable_errors
+def search(query: str, playlist_limit: int = 0) -> Union[str, dict, None]:
+    """Search for a query or url and return webpage url of the first match
+
+    With playlist limit set, a playlist url returns its title and up to
+    that many entries without resolving any of them.
+    """
+    data = _ytdl.extract_info(query, download=False, process=False)
+    if data is None:
+        return None
+    if "entries" not in data:
+        return data.get("webpage_url")
+    if (
+        playlist_limit > 0
+        and data.get("_type") == "playlist"
+        and query.startswith(("http://", "https://"))
+    ):
+        return _playlist(data, playlist_limit)
+    for entry in data["entries"]:
+        if entry:
+            return entry.get("webpage_url") or entry.get("url")
+    return None
+
+
+@_picklable_errors
+def resolve(webpage_url: str, drop_keys: tuple) -> Optional[dict]:
+    """Fully resolve a webpage url including its stream url
+
+    Returns None when nothing was fetched and an empty dict when
+    the url resolved to no entries.
+    """
+    info = _ytdl.extract_info(webpage_url, download=False)
+    if info is None:
+        return None
+    if "entries" in info:
+        info = next((entry for entry in info["entries"] if entry), None)
+        if info is None:
+            return {}
+    info = _ytdl.sanitize_info(info)
+    return {key: value for key, value in info.items() if key not in drop_keys}
@@ -1,12 +1,19 @@
 """Music bot commands cog module"""
+import asyncio
 import math
+import time
 from typing import Optional
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from core.basecog import BaseCog
 
-from .voicestate import VoiceState
+from . import processes, queuestore
+from .audiocache import close_audio_cache, get_audio_cache
+from .extractionpool import get_extraction_pool, shutdown_extraction_pool
+from .playtrace import PlayTrace
+from .streamscheduler import close_stream_scheduler
+from .voicestate import VoiceError, VoiceState
 from .ytdlsource import YTDLError
 
 
@@ -25,11 +32,127 @@ class Music(BaseCog):
         """Music class init with dictionary for voice states"""
         super().__init__(bot)
         self.voice_states = {}
+        self.idle_timeout = self.config.music.get("idle_timeout", 300)
+        self.paused_timeout = self.config.music.get("paused_timeout", 3600)
+        self._orphans = set()
+        get_extraction_pool().start()
+        self.reap_voice_states.change_interval(
+            seconds=self.config.music.get("reap_interval", 60)
+        )
+        self.reap_voice_states.start()
+        self.snapshot_path = self.config.music.get(
+            "queue_snapshot", "data/music_queues.json"
+        )
+        self._restore_task = self.bot.loop.create_task(self.restore_queues())
+
+    def cog_unload(self) -> None:
+        """Snapshot queues, close voice states, workers and streams on unload"""
+        self.reap_voice_states.cancel()
+        self._restore_task.cancel()
+        self.save_queues()
+        for state in self.voice_states.values():
+            self.bot.loop.create_task(state.close())
+        self.voice_states.clear()
+        shutdown_extraction_pool()
+        close_audio_cache()
+        close_stream_scheduler()
+
+    def save_queues(self) -> None:
+        """Snapshot queues of all voice states to resume them after restart"""
+        snapshots = {}
+        for guild_id, state in self.voice_states.items():
+            snapshot = state.snapshot()
+            if snapshot is not None:
+                snapshots[guild_id] = snapshot
+        try:
+            queuestore.save_snapshots(self.snapshot_path, snapshots)
+        except OSError as err:
+            self.logger.error("Failed to save queue snapshot: %s", err)
+            return
+        if snapshots:
+            self.logger.info("Saved queues of %s guilds", len(snapshots))
+
+    async def restore_queues(self) -> None:
+        """Reconnect and resume queues snapshotted before restart or reload
+
+        Guilds whose voice channel is gone or has no listeners left are
+        skipped, songs are resolved only once they are about to play.
+        """
+        await self.bot.wait_until_ready()
+        snapshots = queuestore.load_snapshots(
+            self.snapshot_path, self.config.music.get("queue_snapshot_max_age", 900)
+        )
+        for guild_id, snapshot in snapshots.items():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None or guild_id in self.voice_states:
+                continue
+            voice_channel = guild.get_channel(snapshot["voice_channel"])
+            text_channel = guild.get_channel(snapshot["text_channel"])
+            if voice_channel is None or text_channel is None:
+                continue
+            if not any(not member.bot for member in voice_channel.members):
+                continue
+            if guild.voice_client is not None:
+                await guild.voice_client.disconnect(force=True)
+            state = VoiceState(self.bot, guild)
+            self.voice_states[guild_id] = state
+            try:
+                await state.connect(voice_channel)
+            except (discord.ClientException, asyncio.TimeoutError) as err:
+                self.logger.warning(
+                    "Failed to resume queue of guild %s: %s", guild_id, err
+                )
+                await state.close()
+                if self.voice_states.get(guild_id) is state:
+                    del self.voice_states[guild_id]
+                continue
+            count = state.restore(snapshot, text_channel)
+            self.logger.info("Resumed queue of %s songs in guild %s", count, guild_id)
+            await text_channel.send(f"Resuming queue of {count} songs after restart.")
+
+    @tasks.loop(seconds=60)
+    async def reap_voice_states(self) -> None:
+        """Close idle voice states and kill ffmpeg processes nobody owns
+
+        Voice states with a paused song or queued songs are kept for the
+        longer paused timeout.
+        """
+        for guild_id, state in list(self.voice_states.items()):
+            timeout = self.paused_timeout if state.has_pending else self.idle_timeout
+            if state.idle_for >= timeout:
+                self.logger.info(
+                    "Closing voice state of guild %s idle for %.0f seconds",
+                    guild_id,
+                    state.idle_for,
+                )
+                await state.close()
+                if self.voice_states.get(guild_id) is state:
+                    del self.voice_states[guild_id]
+        self._kill_orphans()
+
+    def _kill_orphans(self) -> None:
+        """Kill ffmpeg children not owned by any source for two reaper runs
+
+        Processes are spawned before their owner learns their pid, so a
+        child is only killed once it was seen unowned on the previous run.
+        """
+        owned = set(get_audio_cache().pids)
+        for state in self.voice_states.values():
+            owned.update(source.pid for source in list(state.sources))
+        orphans = {
+            pid
+            for pid, name in processes.child_processes().items()
+            if name == "ffmpeg" and pid not in owned
+        }
+        for pid in orphans & self._orphans:
+            self.logger.warning("Killing orphaned ffmpeg process %s", pid)
+            processes.kill(pid)
+        self._orphans = orphans - self._orphans
 
     def _get_voice_state(self, ctx) -> VoiceState:
         state = self.voice_states.get(ctx.guild.id)
         if not state:
-            state = VoiceState(self.bot, ctx)
+            state = VoiceState(self.bot, ctx.guild)
             self.voice_states[ctx.guild.id] = state
         return state
 
@@ -44,6 +167,7 @@ class Music(BaseCog):
         """Get voice state before commad invocation"""
         ctx = await super().cog_before_invoke(ctx)
         ctx.voice_state = self._get_voice_state(ctx)
+        ctx.voice_state.touch()
 
     @commands.command(
         name="join", invoke_without_subcommand=True, aliases=["summon", "connect"]
@@ -66,21 +190,26 @@ class Music(BaseCog):
         """Disconnect from the voice channel"""
         if not ctx.voice_state.voice:
             return await ctx.send("I am not in a voice channel.")
-        await ctx.voice_state.stop()
+        await ctx.voice_state.close()
         del self.voice_states[ctx.guild.id]
 
     @commands.command(name="play", aliases=["p"])
     async def play(self, ctx: commands.Context, *, query: str) -> None:
         """Play a song by query or link"""
+        trace = PlayTrace(query)
         if not ctx.voice_state.voice:
+            started = time.monotonic()
             await ctx.invoke(self._join)
+            trace.since("connect", started)
         async with ctx.typing():
             try:
-                song = await ctx.voice_state.add_song(query)
-            except YTDLError as err:
+                song = await ctx.voice_state.add_song(ctx, query, trace)
+            except (YTDLError, VoiceError) as err:
                 return await ctx.send(
                     f"An error occurred while processing this request: {str(err)}"
                 )
+            if isinstance(song, list):
+                return await ctx.send(f"Enqued {len(song)} songs from playlist.")
             await ctx.send("Enqued:", embed=song.make_song_embed())
 
     @commands.command(name="stop")
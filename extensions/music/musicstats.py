@@ -0,0 +1,175 @@
+"""Music statistics commands cog module"""
+from collections import Counter
+
+import discord
+from discord.ext import commands
+from core.basecog import BaseCog
+
+from . import processes
+from .audiocache import get_audio_cache
+from .decodehub import hub_stats
+from .extractionpool import get_extraction_pool
+from .playtrace import RECENT_TRACES, STAGE_HISTOGRAMS, STAGES, TOTAL_HISTOGRAM
+from .streamscheduler import get_stream_scheduler
+from .voicestate import HANDOFF_COLD, HANDOFF_WARM
+from .ytdlsource import YTDLSource
+
+
+def _cache_summary(cache) -> str:
+    """Summarize cache size and hit counters"""
+    return (
+        f"{len(cache)}/{cache.maxsize} entries\n"
+        f"{cache.hits} hits, {cache.misses} misses ({cache.hit_ratio:.0%})"
+    )
+
+
+class MusicStats(BaseCog):
+    """Owner commands reporting music extension resource usage
+
+    Kept apart from the Music cog, which requires the author to be
+    in a voice channel and creates a voice state for every command.
+    """
+
+    def _guild_name(self, guild_id: int) -> str:
+        """Get name of guild or its id when the guild is unknown"""
+        guild = self.bot.get_guild(guild_id)
+        return guild.name if guild else str(guild_id)
+
+    def _voice_states(self) -> dict:
+        """Get voice states of the music cog"""
+        music = self.bot.get_cog("Music")
+        return music.voice_states if music else {}
+
+    @commands.is_owner()
+    @commands.command()
+    async def music_stats(self, ctx: commands.Context) -> None:
+        """Show ffmpeg processes and queue lengths of all voice states"""
+        embed = discord.Embed(title="Music", color=0x00FF00)
+        voice_states = self._voice_states()
+        processes = sum(state.process_count for state in voice_states.values())
+        embed.add_field(name="Voice states", value=str(len(voice_states)))
+        embed.add_field(name="ffmpeg processes", value=str(processes))
+        embed.add_field(
+            name="Search cache", value=_cache_summary(YTDLSource.search_cache)
+        )
+        embed.add_field(name="Info cache", value=_cache_summary(YTDLSource.info_cache))
+        track_index = YTDLSource.track_index
+        embed.add_field(
+            name="Track index",
+            value=(
+                f"{len(track_index)}/{track_index.maxsize} tracks\n"
+                f"{track_index.hits} hits, {track_index.misses} misses"
+                f" ({track_index.hit_ratio:.0%})"
+            ),
+        )
+        audio_cache = get_audio_cache()
+        used_mb = audio_cache.total_bytes // 2**20
+        max_mb = audio_cache.max_bytes // 2**20
+        embed.add_field(
+            name="Audio cache",
+            value=(
+                f"{len(audio_cache)} songs, {used_mb}/{max_mb} MB,"
+                f" {audio_cache.transcoding} transcoding\n"
+                f"{audio_cache.hits} hits, {audio_cache.misses} misses"
+            ),
+        )
+        pool = get_extraction_pool()
+        embed.add_field(
+            name="Extraction pool",
+            value=(
+                f"{pool.running}/{pool.workers} running,"
+                f" {pool.pending}/{pool.max_pending} queued\n"
+                f"{pool.rejected} rejected, {pool.timeouts} timed out"
+            ),
+        )
+        scheduler = get_stream_scheduler()
+        embed.add_field(
+            name="Stream budget",
+            value=(
+                f"{scheduler.used}/{scheduler.budget} used"
+                f" ({scheduler.utilization:.0%}), {scheduler.streams} streams,"
+                f" {scheduler.waiting} waiting\n"
+                f"{scheduler.degraded} degraded, {scheduler.rejected} rejected"
+            ),
+        )
+        hubs, subscribers = hub_stats()
+        embed.add_field(
+            name="Shared decoders", value=f"{hubs} decoders, {subscribers} subscribers"
+        )
+        embed.add_field(name="Stream queue wait", value=scheduler.queue_wait.summary())
+        embed.add_field(name="Extraction queue wait", value=pool.queue_wait.summary())
+        embed.add_field(name="Extraction latency", value=pool.latency.summary())
+        embed.add_field(name="Handoff (cold)", value=HANDOFF_COLD.summary())
+        embed.add_field(name="Handoff (prefetched)", value=HANDOFF_WARM.summary())
+        lines = []
+        for guild_id, state in voice_states.items():
+            lines.append(
+                f"{self._guild_name(guild_id)}:"
+                f" ffmpeg {state.process_count}/{state.max_sources},"
+                f" queue {len(state.songs)}"
+            )
+        if lines:
+            embed.add_field(name="Guilds", value="\n".join(lines)[:1024], inline=False)
+        await ctx.send(embed=embed)
+
+    @commands.is_owner()
+    @commands.command()
+    async def music_states(self, ctx: commands.Context) -> None:
+        """Show live voice states and child processes of the bot"""
+        embed = discord.Embed(title="Music voice states", color=0x00FF00)
+        rss = processes.resident_memory()
+        if rss is not None:
+            embed.add_field(name="Resident memory", value=f"{rss // 2**20} MB")
+        children = processes.child_processes()
+        names = Counter(children.values())
+        embed.add_field(
+            name="Child processes",
+            value=", ".join(f"{name} {count}" for name, count in names.items())
+            or "None",
+        )
+        owned = set()
+        lines = []
+        for guild_id, state in self._voice_states().items():
+            pids = [source.pid for source in list(state.sources)]
+            owned.update(pids)
+            channel = state.voice.channel.name if state.voice else "not connected"
+            if state.is_playing():
+                status = "playing"
+            else:
+                status = f"idle {state.idle_for:.0f}s"
+            lines.append(
+                f"{self._guild_name(guild_id)}: {channel}, {status},"
+                f" queue {len(state.songs)}, ffmpeg {pids or 'none'}"
+            )
+        embed.add_field(
+            name="Voice states",
+            value="\n".join(lines)[:1024] or "None",
+            inline=False,
+        )
+        owned.update(get_audio_cache().pids)
+        unowned = [
+            str(pid)
+            for pid, name in children.items()
+            if name == "ffmpeg" and pid not in owned
+        ]
+        if unowned:
+            embed.add_field(name="Unowned ffmpeg", value=", ".join(unowned))
+        await ctx.send(embed=embed)
+
+    @commands.is_owner()
+    @commands.command()
+    async def music_latency(self, ctx: commands.Context) -> None:
+        """Show time to first audio of the play command split by stage"""
+        embed = discord.Embed(title="Music time to first audio", color=0x00FF00)
+        embed.add_field(name="Total", value=TOTAL_HISTOGRAM.summary(), inline=False)
+        for stage in STAGES:
+            embed.add_field(name=stage, value=STAGE_HISTOGRAMS[stage].summary())
+        if RECENT_TRACES:
+            lines = [
+                f"`{trace.query[:30]}` {trace.summary()}"
+                for trace in reversed(RECENT_TRACES)
+            ]
+            embed.add_field(
+                name="Recent plays", value="\n".join(lines)[:1024], inline=False
+            )
+        await ctx.send(embed=embed)
@@ -0,0 +1,66 @@
+"""Module with time to first audio tracing of the play command for music cog"""
+import time
+from collections import deque
+from typing import Optional
+
+from core.metrics import get_registry
+
+# Stages from the play command to the first audio frame, in order
+STAGES = ("connect", "search", "resolve", "queue", "spawn", "first_frame")
+
+STAGE_HISTOGRAMS = {
+    stage: get_registry().histogram(
+        "coco_music_ttfa_stage_seconds",
+        "Time spent in a stage from the play command to the first audio frame",
+        stage=stage,
+    )
+    for stage in STAGES
+}
+TOTAL_HISTOGRAM = get_registry().histogram(
+    "coco_music_ttfa_seconds", "Time from the play command to the first audio frame"
+)
+
+# Last finished traces, newest last
+RECENT_TRACES = deque(maxlen=10)
+
+
+class PlayTrace:
+    """Timings of the stages a played song went through"""
+
+    __slots__ = ("started", "enqueued_at", "stages", "total", "query")
+
+    def __init__(self, query: str = "") -> None:
+        """Start tracing now"""
+        self.started = time.monotonic()
+        self.enqueued_at = None
+        self.stages = {}
+        self.total = None
+        self.query = query
+
+    def add(self, stage: str, seconds: float) -> None:
+        """Add time spent in stage"""
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def since(self, stage: str, start: float) -> None:
+        """Add time from start until now to stage"""
+        self.add(stage, time.monotonic() - start)
+
+    def finish(self, first_frame_at: Optional[float] = None) -> None:
+        """Record stage timings and total time to first frame to histograms
+
+        May be called from the player thread.
+        """
+        self.total = (first_frame_at or time.monotonic()) - self.started
+        for stage, seconds in self.stages.items():
+            STAGE_HISTOGRAMS[stage].observe(seconds)
+        TOTAL_HISTOGRAM.observe(self.total)
+        RECENT_TRACES.append(self)
+
+    def summary(self) -> str:
+        """Short breakdown of the trace in milliseconds"""
+        stages = ", ".join(
+            f"{stage} {self.stages[stage] * 1000:.0f}"
+            for stage in STAGES
+            if stage in self.stages
+        )
+        return f"{self.total * 1000:.0f}ms ({stages})"
@@ -0,0 +1,50 @@
+"""Module with helpers inspecting child processes of the bot for music cog"""
+import os
+import signal
+from typing import Dict, Optional
+
+
+def child_processes() -> Dict[int, str]:
+    """Get pids and names of direct child processes of the bot
+
+    Reads /proc, so on systems without it no children are reported.
+    """
+    children = {}
+    parent = os.getpid()
+    try:
+        pids = [int(name) for name in os.listdir("/proc") if name.isdigit()]
+    except FileNotFoundError:
+        return children
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat", "r", encoding="utf-8") as stat_file:
+                stat = stat_file.read()
+        except OSError:
+            continue
+        # Name is in parentheses and may contain spaces, ppid follows state
+        name = stat[stat.find("(") + 1 : stat.rfind(")")]
+        fields = stat[stat.rfind(")") + 2 :].split()
+        if int(fields[1]) == parent:
+            children[pid] = name
+    return children
+
+
+def resident_memory() -> Optional[int]:
+    """Get resident memory of the bot process in bytes"""
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def kill(pid: int) -> None:
+    """Kill child process and reap it if it already exited"""
+    try:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, os.WNOHANG)
+    except (ProcessLookupError, ChildProcessError):
+        pass
@@ -0,0 +1,41 @@
+"""Module with queue snapshots kept across restarts for music cog"""
+import json
+import os
+import time
+
+
+def save_snapshots(path: str, snapshots: dict) -> None:
+    """Write snapshots of guild queues to path atomically"""
+    if not snapshots:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(
+            {"saved_at": time.time(), "guilds": snapshots},
+            file,
+            separators=(",", ":"),
+        )
+    os.replace(tmp_path, path)
+
+
+def load_snapshots(path: str, max_age: float) -> dict:
+    """Read and remove snapshots of guild queues, ignoring stale ones
+
+    Returns guild ids mapped to their snapshot, the file is removed so
+    a snapshot is restored at most once.
+    """
+    try:
+        with open(path, encoding="utf-8") as file:
+            data = json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError):
+        data = {}
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    if time.time() - data.get("saved_at", 0) > max_age:
+        return {}
+    return {int(guild_id): queue for guild_id, queue in data["guilds"].items()}
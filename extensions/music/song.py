@@ -1,29 +1,119 @@
 """Module with Song class for voice state class"""
 import discord
+from discord.ext import commands
+
+from .track import Track
 from .ytdlsource import YTDLSource
 
 
 class Song:
-    """Class for Song objects"""
+    """Class for Song objects
+
+    Holds a compact Track with the metadata needed for the queue and embeds,
+    full yt-dlp info is resolved again on demand. The audio source is created
+    right before the song is played. Songs queued from a playlist start with
+    just a url, title and duration and are resolved on refresh.
+    """
 
-    __slots__ = ("source", "requester", "title", "url")
+    __slots__ = (
+        "requester",
+        "channel",
+        "track",
+        "stream_url",
+        "expires_at",
+        "source",
+        "trace",
+    )
 
-    def __init__(self, source: YTDLSource):
+    def __init__(self, ctx: commands.Context, info: dict):
         """Initializes the Song object"""
-        self.source = source
-        self.requester = source.requester
-        self.title = source.title
-        self.url = source.url
+        self.requester = ctx.author
+        self.channel = ctx.channel
+        self.source = None
+        self.trace = None
+        self.update(info)
+
+    @classmethod
+    def from_entry(
+        cls, ctx: commands.Context, url: str, title: str, duration: int
+    ) -> "Song":
+        """Create unresolved song from a playlist entry"""
+        return cls(ctx, {"webpage_url": url, "title": title, "duration": duration})
+
+    @classmethod
+    def restore(
+        cls, requester: discord.Member, channel: discord.TextChannel, track: Track
+    ) -> "Song":
+        """Create unresolved song from a track of a queue snapshot"""
+        song = cls.__new__(cls)
+        song.requester = requester
+        song.channel = channel
+        song.source = None
+        song.trace = None
+        song.track = track
+        song.stream_url = None
+        song.expires_at = 0.0
+        return song
+
+    def update(self, info: dict) -> None:
+        """Update song metadata and stream url from yt-dlp info"""
+        self.track = Track.from_info(info)
+        self.stream_url = info.get("url")
+        self.expires_at = info.get("stream_expires_at", 0.0)
+
+    @property
+    def title(self) -> str:
+        """Title of the track"""
+        return self.track.title
+
+    @property
+    def url(self) -> str:
+        """Webpage url of the track"""
+        return self.track.url
+
+    @property
+    def uploader(self) -> str:
+        """Uploader of the track"""
+        return self.track.uploader
+
+    @property
+    def uploader_url(self) -> str:
+        """Url of the uploader of the track"""
+        return self.track.uploader_url
+
+    @property
+    def upload_date(self) -> str:
+        """Upload date of the track in dd.mm.yyyy format"""
+        return self.track.formatted_upload_date
+
+    @property
+    def thumbnail(self) -> str:
+        """Thumbnail url of the track"""
+        return self.track.thumbnail
+
+    @property
+    def duration(self) -> int:
+        """Duration of the track in seconds"""
+        return self.track.duration
+
+    async def full_info(self) -> dict:
+        """Get full yt-dlp info of the track, resolving it if not cached"""
+        return await YTDLSource.resolve(self.url, self.channel.guild.id)
 
     def make_song_embed(self) -> discord.Embed:
         """Returns an embed for the song"""
-        embed = discord.Embed(title=f"{self.source.title}", url=f"{self.source.url}")
-        embed.set_thumbnail(url=f"{self.source.thumbnail}")
-        embed.add_field(name="Duration", value=f"{self.source.duration}")
+        embed = discord.Embed(title=f"{self.title}", url=f"{self.url}")
+        if self.thumbnail:
+            embed.set_thumbnail(url=self.thumbnail)
         embed.add_field(
-            name="Uploader",
-            value=f"[{self.source.uploader}]({self.source.uploader_url})",
+            name="Duration",
+            value=YTDLSource.parse_duration(self.duration) or "Unknown",
         )
-        embed.add_field(name="Upload date", value=f"{self.source.upload_date}")
+        if self.uploader and self.uploader_url:
+            uploader = f"[{self.uploader}]({self.uploader_url})"
+        else:
+            uploader = self.uploader or "Unknown"
+        embed.add_field(name="Uploader", value=uploader)
+        embed.add_field(name="Upload date", value=f"{self.upload_date or 'Unknown'}")
         embed.set_footer(text=f"Requested by {self.requester.display_name}")
         return embed
@@ -0,0 +1,198 @@
+"""Module with global budget of concurrent audio streams for music cog"""
+import asyncio
+import time
+from collections import deque
+from typing import Optional
+
+from core.config import get_config
+from core.metrics import get_registry
+
+
+class StreamBudgetError(Exception):
+    """Exception for playbacks that didn't fit the stream budget in time"""
+
+
+class StreamLease:
+    """Share of the stream budget held by one audio source"""
+
+    __slots__ = ("scheduler", "mode", "cost", "released")
+
+    def __init__(self, scheduler: "StreamScheduler", mode: str, cost: int) -> None:
+        """Init lease of given playback mode and cost"""
+        self.scheduler = scheduler
+        self.mode = mode
+        self.cost = cost
+        self.released = False
+
+    def set_mode(self, mode: str) -> None:
+        """Change mode of the leased stream, returning budget it no longer needs"""
+        self.scheduler.resize(self, mode)
+
+    def release(self) -> None:
+        """Return leased budget to the scheduler"""
+        self.scheduler.release(self)
+
+
+class StreamScheduler:
+    """Budget of concurrent ffmpeg streams shared by all guilds
+
+    Each playback mode has a cost, PCM streams also cost the volume
+    scaling done in Python. When a stream doesn't fit the budget it is
+    degraded to the cheapest mode, and when even that doesn't fit it
+    waits in a FIFO queue until another stream ends. Subscribers of a
+    shared decoder are free, the decoder holds the lease of the source
+    that started it.
+    """
+
+    COSTS = {"pcm": 2, "opus": 1, "cached": 1, "shared": 0}
+    CHEAPEST = "opus"
+
+    def __init__(self, budget: int, queue_timeout: float, degrade: bool) -> None:
+        """Init scheduler with total budget"""
+        self.budget = budget
+        self.queue_timeout = queue_timeout
+        self.degrade = degrade
+
+        self.used = 0
+        self.streams = 0
+        self.admitted = 0
+        self.degraded = 0
+        self.queued = 0
+        self.rejected = 0
+        self.queue_wait = get_registry().histogram(
+            "coco_music_stream_queue_wait_seconds",
+            "Time new streams wait for the stream budget",
+        )
+        self._waiters = deque()
+
+    @property
+    def utilization(self) -> float:
+        """Used fraction of the budget"""
+        return self.used / self.budget if self.budget else 1.0
+
+    @property
+    def waiting(self) -> int:
+        """Number of playbacks waiting for budget"""
+        return sum(not future.done() for future, _ in self._waiters)
+
+    def _grant(self, mode: str) -> Optional[StreamLease]:
+        """Lease budget for mode, degrading it when allowed and needed"""
+        cost = self.COSTS[mode]
+        if self.used + cost > self.budget:
+            if not self.degrade or mode == self.CHEAPEST:
+                return None
+            mode = self.CHEAPEST
+            cost = self.COSTS[mode]
+            if self.used + cost > self.budget:
+                return None
+            self.degraded += 1
+        self.used += cost
+        self.streams += 1
+        self.admitted += 1
+        return StreamLease(self, mode, cost)
+
+    def free_lease(self) -> StreamLease:
+        """Lease nothing, for sources whose budget is held elsewhere"""
+        self.streams += 1
+        self.admitted += 1
+        return StreamLease(self, "shared", 0)
+
+    def try_acquire(self, mode: str) -> Optional[StreamLease]:
+        """Lease budget right away or return None, never jumps the queue"""
+        self._wake()
+        if self._waiters:
+            return None
+        return self._grant(mode)
+
+    async def acquire(self, mode: str) -> StreamLease:
+        """Lease budget for mode, waiting in queue when the budget is full"""
+        lease = self.try_acquire(mode)
+        if lease is not None:
+            return lease
+        self.queued += 1
+        queued_at = time.monotonic()
+        future = asyncio.get_event_loop().create_future()
+        self._waiters.append((future, mode))
+        try:
+            lease = await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError as err:
+            self._abandon(future)
+            self.rejected += 1
+            raise StreamBudgetError(
+                "Too many songs are playing right now, try again later."
+            ) from err
+        except asyncio.CancelledError:
+            self._abandon(future)
+            raise
+        self.queue_wait.observe(time.monotonic() - queued_at)
+        return lease
+
+    def _abandon(self, future: asyncio.Future) -> None:
+        """Give up waiting, returning a lease granted in the meantime"""
+        if future.done() and not future.cancelled():
+            future.result().release()
+        else:
+            future.cancel()
+        self._wake()
+
+    def _wake(self) -> None:
+        """Grant budget to waiters in order while it fits"""
+        while self._waiters:
+            future, mode = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            lease = self._grant(mode)
+            if lease is None:
+                break
+            self._waiters.popleft()
+            future.set_result(lease)
+
+    def resize(self, lease: StreamLease, mode: str) -> None:
+        """Change mode and cost of a held lease"""
+        if lease.released:
+            return
+        cost = self.COSTS[mode]
+        self.used += cost - lease.cost
+        lease.mode = mode
+        lease.cost = cost
+        self._wake()
+
+    def release(self, lease: StreamLease) -> None:
+        """Return budget of lease, releasing twice is a no-op"""
+        if lease.released:
+            return
+        lease.released = True
+        self.used -= lease.cost
+        self.streams -= 1
+        self._wake()
+
+    def close(self) -> None:
+        """Cancel all waiting playbacks"""
+        for future, _ in self._waiters:
+            future.cancel()
+        self._waiters.clear()
+
+
+_scheduler = None
+
+
+def get_stream_scheduler() -> StreamScheduler:
+    """Returns stream scheduler configured from the music config"""
+    global _scheduler  # pylint: disable=global-statement
+    if _scheduler is None:
+        music_config = get_config().music
+        _scheduler = StreamScheduler(
+            budget=music_config.get("stream_budget", 16),
+            queue_timeout=music_config.get("stream_queue_timeout", 30),
+            degrade=music_config.get("stream_degrade", True),
+        )
+    return _scheduler
+
+
+def close_stream_scheduler() -> None:
+    """Cancel waiters of stream scheduler, a new one is created on next use"""
+    global _scheduler  # pylint: disable=global-statement
+    if _scheduler is not None:
+        _scheduler.close()
+        _scheduler = None
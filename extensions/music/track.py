@@ -0,0 +1,86 @@
+"""Module with compact track records for music cog"""
+import sys
+from typing import Optional
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    """Intern strings repeated across many tracks"""
+    return sys.intern(value) if value else None
+
+
+class Track:
+    """Compact metadata of a track, shared by queue entries and the track index
+
+    Keeps only the fields shown in embeds, full yt-dlp info is resolved
+    again on demand. Uploader fields are interned, as queues often hold
+    many tracks of the same uploader.
+    """
+
+    __slots__ = (
+        "url",
+        "title",
+        "uploader",
+        "uploader_url",
+        "upload_date",
+        "thumbnail",
+        "duration",
+    )
+
+    def __init__(
+        self,
+        url: str,
+        title: Optional[str] = None,
+        uploader: Optional[str] = None,
+        uploader_url: Optional[str] = None,
+        upload_date: Optional[str] = None,
+        thumbnail: Optional[str] = None,
+        duration: Optional[float] = None,
+    ) -> None:
+        """Init track, upload date is in yt-dlp YYYYMMDD format"""
+        self.url = url
+        self.title = title
+        self.uploader = _intern(uploader)
+        self.uploader_url = _intern(uploader_url)
+        self.upload_date = _intern(upload_date)
+        self.thumbnail = thumbnail
+        self.duration = int(duration or 0)
+
+    @classmethod
+    def from_info(cls, info: dict) -> "Track":
+        """Create track from yt-dlp info"""
+        return cls(
+            info.get("webpage_url"),
+            info.get("title"),
+            info.get("uploader"),
+            info.get("uploader_url"),
+            info.get("upload_date"),
+            info.get("thumbnail"),
+            info.get("duration"),
+        )
+
+    def to_info(self) -> dict:
+        """Get track metadata as yt-dlp style info without a stream url"""
+        return {
+            "webpage_url": self.url,
+            "title": self.title,
+            "uploader": self.uploader,
+            "uploader_url": self.uploader_url,
+            "upload_date": self.upload_date,
+            "thumbnail": self.thumbnail,
+            "duration": self.duration,
+        }
+
+    def to_list(self) -> list:
+        """Get track fields as a list, the compact form used in snapshots"""
+        return [getattr(self, field) for field in self.__slots__]
+
+    @classmethod
+    def from_list(cls, fields: list) -> "Track":
+        """Create track from fields listed by to_list"""
+        return cls(*fields)
+
+    @property
+    def formatted_upload_date(self) -> Optional[str]:
+        """Upload date in dd.mm.yyyy format"""
+        date = self.upload_date
+        return f"{date[6:8]}.{date[4:6]}.{date[0:4]}" if date else None
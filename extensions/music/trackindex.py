@@ -0,0 +1,149 @@
+"""Module with local fuzzy search index of resolved tracks for music cog"""
+import math
+import re
+import sys
+import unicodedata
+from collections import OrderedDict
+from typing import FrozenSet, List, Optional
+
+from .track import Track
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into casefolded tokens without accents and punctuation"""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return _NON_WORD.sub(" ", text).split()
+
+
+def trigrams(text: str) -> FrozenSet[str]:
+    """Get trigrams of all tokens of text, tokens are padded with spaces"""
+    grams = set()
+    for token in tokenize(text):
+        padded = f" {token} "
+        grams.update(sys.intern(padded[i : i + 3]) for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+class TrackIndex:
+    """Bounded index of resolved tracks searchable by title, uploader and tags
+
+    Tracks are matched by the share of query trigrams they contain, so
+    small typos and reordered words still match. The query must also
+    cover the title or an alias of the track just as well, so partial
+    queries like an artist name alone are left to yt-dlp. Queries that
+    led to a track through yt-dlp are kept as its aliases and settle ties.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        min_score: float = 0.85,
+        max_tags: int = 10,
+        max_aliases: int = 5,
+    ) -> None:
+        """Init empty index holding at most maxsize tracks"""
+        self.maxsize = maxsize
+        self.min_score = min_score
+        self.max_tags = max_tags
+        self.max_aliases = max_aliases
+
+        self.hits = 0
+        self.misses = 0
+        # webpage url -> (track, aliases, trigrams, title and alias trigrams)
+        self._tracks = OrderedDict()
+        self._postings = {}
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+    def __contains__(self, webpage_url: str) -> bool:
+        return webpage_url in self._tracks
+
+    def add(self, info: dict, alias: Optional[str] = None) -> None:
+        """Index resolved yt-dlp info, optionally with the query that found it"""
+        url = info.get("webpage_url")
+        if not url or not info.get("title"):
+            return
+        texts = [info["title"], info.get("uploader") or ""]
+        texts.extend(str(tag) for tag in (info.get("tags") or ())[: self.max_tags])
+        old = self._tracks.get(url)
+        aliases = list(old[1]) if old is not None else []
+        if alias and not alias.startswith(("http://", "https://")):
+            alias = " ".join(tokenize(alias))
+            if alias in aliases:
+                aliases.remove(alias)
+            aliases = ([alias] + aliases)[: self.max_aliases]
+        texts.extend(aliases)
+        self._remove(url)
+        grams = trigrams(" ".join(texts))
+        names = tuple(trigrams(name) for name in [info["title"]] + aliases)
+        self._tracks[url] = (Track.from_info(info), tuple(aliases), grams, names)
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(url)
+        while len(self._tracks) > self.maxsize:
+            self._remove(next(iter(self._tracks)))
+
+    def _remove(self, url: str) -> None:
+        """Remove track and its trigram postings"""
+        track = self._tracks.pop(url, None)
+        if track is None:
+            return
+        for gram in track[2]:
+            posting = self._postings[gram]
+            posting.discard(url)
+            if not posting:
+                del self._postings[gram]
+
+    def info(self, webpage_url: str) -> Optional[dict]:
+        """Get indexed metadata of a track as yt-dlp style info"""
+        track = self._tracks.get(webpage_url)
+        if track is None:
+            return None
+        self._tracks.move_to_end(webpage_url)
+        return track[0].to_info()
+
+    def _covers(self, query: FrozenSet[str], url: str) -> bool:
+        """Check if query has enough trigrams of the title or an alias of track"""
+        return any(
+            len(query & name) >= self.min_score * len(name)
+            for name in self._tracks[url][3]
+        )
+
+    def _matches(self, query: FrozenSet[str]) -> List[str]:
+        """Get urls of tracks matching query in both directions"""
+        postings = sorted((self._postings.get(gram, ()) for gram in query), key=len)
+        # A track missing from all of the rarest postings can't reach min score
+        rarest = len(query) - math.ceil(self.min_score * len(query)) + 1
+        candidates = set().union(*postings[:rarest])
+        return [
+            url
+            for url in candidates
+            if len(query & self._tracks[url][2]) >= self.min_score * len(query)
+            and self._covers(query, url)
+        ]
+
+    def search(self, query: str) -> Optional[dict]:
+        """Find a confident match for search query
+
+        Returns metadata of the only matching track, or of the only one
+        found by this query before. Ambiguous queries are left to yt-dlp.
+        """
+        grams = trigrams(query)
+        matches = self._matches(grams) if len(grams) >= 4 else []
+        if len(matches) > 1:
+            alias = " ".join(tokenize(query))
+            matches = [url for url in matches if alias in self._tracks[url][1]]
+        if len(matches) != 1:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.info(matches[0])
+
+    @property
+    def hit_ratio(self) -> float:
+        """Ratio of confident matches to all searches"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
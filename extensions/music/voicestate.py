@@ -1,14 +1,44 @@
 """Voice state class for music module"""
 import asyncio
+import functools
+import time
+from typing import List, Optional, Union
+
 import discord
 
 from async_timeout import timeout
 from discord.ext import commands
 
+from core.config import get_config
+from core.metrics import get_registry
 from extensions.music.ytdlsource import YTDLError
 from .song import Song
 from .songqueue import SongQueue
-from .ytdlsource import YTDLSource
+from .track import Track
+from .audiocache import get_audio_cache
+from .playtrace import PlayTrace
+from .streamscheduler import StreamBudgetError, get_stream_scheduler
+from .ytdlsource import (
+    CachedSource,
+    Playlist,
+    SharedSource,
+    TrackedSource,
+    YTDLSource,
+)
+
+
+# Time from the end of one song (or from dequeuing one after an idle
+# player) to the first audio frame of the next, split by prefetched sources
+HANDOFF_COLD = get_registry().histogram(
+    "coco_music_handoff_seconds",
+    "Time from the end of a song to the first frame of the next one",
+    source="cold",
+)
+HANDOFF_WARM = get_registry().histogram(
+    "coco_music_handoff_seconds",
+    "Time from the end of a song to the first frame of the next one",
+    source="warm",
+)
 
 
 class VoiceError(Exception):
@@ -18,10 +48,10 @@ class VoiceError(Exception):
 class VoiceState:
     """Bot voice state for each guild"""
 
-    def __init__(self, bot: commands.Bot, ctx: commands.Context) -> None:
+    def __init__(self, bot: commands.Bot, guild: discord.Guild) -> None:
         """Init voice state"""
         self.bot = bot
-        self.ctx = ctx
+        self.guild = guild
 
         self.current = None
         self.voice = None
@@ -29,7 +59,25 @@ class VoiceState:
         self.songs = SongQueue()
 
         self.loop = False
-        self._volume = 0.5
+        music_config = get_config().music
+        self._volume = music_config.get("default_volume", 0.5)
+        self.playback_mode = music_config.get("playback_mode", "pcm")
+        self.loudnorm = music_config.get("loudnorm", False)
+        self.shared_decode = music_config.get("shared_decode", True)
+        self._swap_task = None
+        self.max_sources = music_config.get("max_sources_per_guild", 2)
+        self.sources = {}
+        self._source_slots = asyncio.Semaphore(self.max_sources)
+
+        self.playlist_limit = music_config.get("playlist_limit", 1000)
+        self.prefetch_depth = music_config.get("prefetch_depth", 2)
+        self.warm_ahead = music_config.get("warm_ahead", 15)
+        self._prefetch_task = None
+        self._warm = None
+        self._ended_at = None
+        self.resume_position = 0.0
+        self.last_active = time.monotonic()
+
         self.audio_player = self.bot.loop.create_task(self.audio_player_task())
 
     @property
@@ -39,13 +87,126 @@ class VoiceState:
 
     @volume.setter
     def volume(self, value: float) -> None:
-        """Set volume"""
+        """Set volume
+
+        Sources with volume in the ffmpeg filter graph are restarted at
+        the current position, or the new volume applies from the next song
+        when there is no free process slot for the swap.
+        """
         self._volume = value
-        if self.voice:
+        if not (self.voice and self.current and self.current.source):
+            return
+        if self.current.source.live_volume:
             self.current.source.volume = value
+            return
+        self._release_warm()
+        self._schedule_swap()
+
+    def _schedule_swap(self) -> None:
+        """Replace source of the current song with a private one soon"""
+        if self._swap_task is not None:
+            self._swap_task.cancel()
+        self._swap_task = self.bot.loop.create_task(self._swap_source())
+
+    def _on_lag(self, source: TrackedSource) -> None:
+        """Replace shared source that fell behind, called from the player thread"""
+        self.bot.loop.call_soon_threadsafe(self._unshare, source)
+
+    def _unshare(self, source: TrackedSource) -> None:
+        """Replace shared source of the current song with a private one"""
+        if (
+            isinstance(source, SharedSource)
+            and self.current is not None
+            and self.current.source is source
+        ):
+            self._schedule_swap()
+
+    async def _swap_source(self) -> None:
+        """Replace source of the current song with a private one at same position"""
+        old = self.current.source
+        if old is None or self._source_slots.locked():
+            return
+        try:
+            new = await self.create_source(self.current, start=old.position, wait=False)
+        except (YTDLError, StreamBudgetError, discord.ClientException):
+            return
+        if self.current.source is not old or not self._is_current_active():
+            new.cleanup()
+            return
+        self.current.source = new
+        self.voice.source = new
+        old.cleanup()
 
-    def __del__(self) -> None:
+    @property
+    def process_count(self) -> int:
+        """Number of live ffmpeg processes owned by this voice state"""
+        return len(self.sources)
+
+    def touch(self) -> None:
+        """Mark voice state as used right now"""
+        self.last_active = time.monotonic()
+
+    @property
+    def idle_for(self) -> float:
+        """Seconds since the voice state last played or was used"""
+        if self.is_playing():
+            return 0.0
+        return time.monotonic() - self.last_active
+
+    @property
+    def has_pending(self) -> bool:
+        """Check if a song is paused or waiting in the queue"""
+        return len(self.songs) > 0 or (self.voice is not None and self.is_paused())
+
+    async def close(self) -> None:
+        """Stop player task, disconnect and kill all ffmpeg processes"""
         self.audio_player.cancel()
+        await self.stop()
+        if self.current is not None:
+            self.current.source = None
+        for source in list(self.sources):
+            source.cleanup()
+
+    def snapshot(self) -> Optional[dict]:
+        """Compact snapshot of the queue to resume it after a restart
+
+        The current song is stored first with its position, songs are
+        stored by requester id and track fields without stream urls.
+        """
+        if self.voice is None:
+            return None
+        songs = list(self.songs)
+        position = 0.0
+        if self.current is not None and self._is_current_active():
+            songs.insert(0, self.current)
+            if self.current.source is not None:
+                position = self.current.source.position
+        if not songs:
+            return None
+        return {
+            "voice_channel": self.voice.channel.id,
+            "text_channel": songs[0].channel.id,
+            "volume": self._volume,
+            "loop": self.loop,
+            "position": position,
+            "songs": [[song.requester.id, *song.track.to_list()] for song in songs],
+        }
+
+    def restore(self, snapshot: dict, channel: discord.TextChannel) -> int:
+        """Queue songs of a snapshot, returns number of songs queued
+
+        Songs are resolved only when they get close to the player, the
+        first one resumes at the snapshot position.
+        """
+        self._volume = snapshot["volume"]
+        self.loop = snapshot["loop"]
+        self.resume_position = snapshot["position"]
+        for requester_id, *fields in snapshot["songs"]:
+            requester = self.guild.get_member(requester_id) or self.guild.me
+            self.songs.put_nowait(
+                Song.restore(requester, channel, Track.from_list(fields))
+            )
+        return len(snapshot["songs"])
 
     def is_playing(self) -> bool:
         """Check if player is playing"""
@@ -72,8 +233,14 @@ class VoiceState:
         self.voice.pause()
 
     def resume(self) -> None:
-        """Resume voice"""
+        """Resume voice
+
+        Shared sources continue on a private stream, the other subscribers
+        went on playing while this one was paused.
+        """
         self.voice.resume()
+        if self.current is not None:
+            self._unshare(self.current.source)
 
     async def connect(self, destination: discord.VoiceChannel) -> None:
         """Connect to voice channel"""
@@ -85,16 +252,29 @@ class VoiceState:
 
     async def stop(self) -> None:
         """Stop voice"""
+        if self._swap_task is not None:
+            self._swap_task.cancel()
+        self._cancel_prefetch()
+        self._release_warm()
         self.songs.clear()
         if self.voice:
             await self.voice.disconnect()
             self.voice = None
 
-    async def add_song(self, query: str) -> Song:
-        """Add song to queue"""
+    async def add_song(
+        self, ctx: commands.Context, query: str, trace: Optional[PlayTrace] = None
+    ) -> Union[Song, List[Song]]:
+        """Add song or all songs of a playlist url to queue
+
+        Only the metadata is resolved here, the audio source is created
+        when the song reaches the player. Playlist entries are queued
+        unresolved and resolved once they get close to the player.
+        A trace follows the song, or the first song of a playlist.
+        """
         try:
-            source = await YTDLSource.create_source(self.ctx, query)
-            song = Song(source)
+            result = await YTDLSource.extract(
+                query, ctx.guild.id, playlist_limit=self.playlist_limit, trace=trace
+            )
         except YTDLError as err:
             raise VoiceError(str(err)) from err
         try:
@@ -102,27 +282,149 @@ class VoiceState:
                 self.audio_player = self.bot.loop.create_task(self.audio_player_task())
         except Exception as err:
             raise VoiceError(str(err)) from err
+        if trace is not None:
+            trace.enqueued_at = time.monotonic()
+        if isinstance(result, Playlist):
+            songs = [Song.from_entry(ctx, *entry) for entry in result.entries]
+            songs[0].trace = trace
+            for song in songs:
+                self.songs.put_nowait(song)
+            return songs
+        song = Song(ctx, result)
+        song.trace = trace
         await self.songs.put(song)
         return song
 
-    async def redo_song(self) -> Song:
-        """Redo song"""
-        source = await YTDLSource.create_source(self.ctx, self.current.source.url)
+    async def create_source(
+        self, song: Song, start: float = 0.0, wait: bool = True, shared: bool = False
+    ) -> TrackedSource:
+        """Create audio source for song within the per-guild and global limits
+
+        The playback mode may be degraded by the stream scheduler. Without
+        wait, StreamBudgetError is raised instead of waiting for budget.
+        Shared sources may join a decoder started by another guild.
+        """
+        await self._source_slots.acquire()
+        lease = None
         try:
-            song = Song(source)
-        except YTDLError as err:
-            raise VoiceError(str(err)) from err
-        return song
+            scheduler = get_stream_scheduler()
+            if wait:
+                lease = await scheduler.acquire(self.playback_mode)
+            else:
+                lease = scheduler.try_acquire(self.playback_mode)
+                if lease is None:
+                    raise StreamBudgetError("No stream budget left.")
+            source = await YTDLSource.create_source(
+                song,
+                volume=self._volume,
+                start=start,
+                mode=lease.mode,
+                loudnorm=self.loudnorm,
+                on_cleanup=self._release_source,
+                shared=shared and self.shared_decode,
+                on_lag=self._on_lag,
+            )
+        except BaseException:
+            self._source_slots.release()
+            if lease is not None:
+                lease.release()
+            raise
+        if isinstance(source, CachedSource):
+            lease.set_mode("cached")
+        elif isinstance(source, SharedSource):
+            if source.hub.lease is None:
+                source.hub.lease = lease
+                lease = scheduler.free_lease()
+            else:
+                lease.set_mode("shared")
+        self.sources[source] = lease
+        return source
+
+    def _release_source(self, source: TrackedSource) -> None:
+        """Release process slot of a cleaned up source, may run in player thread"""
+        self.bot.loop.call_soon_threadsafe(self._discard_source, source)
+
+    def _discard_source(self, source: TrackedSource) -> None:
+        """Forget cleaned up source and free its process slot and budget"""
+        lease = self.sources.pop(source, None)
+        if lease is not None:
+            self._source_slots.release()
+            lease.release()
+
+    def _cancel_prefetch(self) -> None:
+        """Cancel prefetching of upcoming songs"""
+        if self._prefetch_task is not None:
+            self._prefetch_task.cancel()
+            self._prefetch_task = None
+
+    def _release_warm(self, keep: Song = None) -> None:
+        """Kill prefetched source unless it belongs to the song about to play"""
+        if self._warm is not None and self._warm is not keep:
+            if self._warm.source is not None:
+                self._warm.source.cleanup()
+                self._warm.source = None
+        self._warm = None
+
+    def _is_current_active(self) -> bool:
+        """Check if current song is playing or paused"""
+        return self.voice is not None and (
+            self.voice.is_playing() or self.voice.is_paused()
+        )
+
+    async def prefetch(self) -> None:
+        """Prepare upcoming songs while the current one plays
+
+        Stream urls of the next songs are refreshed right away, the ffmpeg
+        process of the next song is spawned shortly before the current
+        song ends, so the handoff does not wait for either.
+        """
+        for song in self.songs[: self.prefetch_depth]:
+            try:
+                await YTDLSource.refresh(song)
+            except YTDLError:
+                pass
+
+        while self._is_current_active() and self.current.source is not None:
+            remaining = self.current.duration - self.current.source.position
+            if remaining <= self.warm_ahead:
+                break
+            await asyncio.sleep(remaining - self.warm_ahead)
+
+        if self.loop or len(self.songs) == 0 or self._source_slots.locked():
+            return
+        song = self.songs[0]
+        if song.source is None:
+            try:
+                song.source = await self.create_source(song, wait=False)
+            except (YTDLError, StreamBudgetError, discord.ClientException):
+                return
+            self._warm = song
+
+    def _record_handoff(
+        self,
+        handoff_from: float,
+        warm: bool,
+        trace: Optional[PlayTrace],
+        played_at: float,
+        source: TrackedSource,
+    ) -> None:
+        """Record time to first frame of a song, called from the player thread"""
+        histogram = HANDOFF_WARM if warm else HANDOFF_COLD
+        histogram.observe(source.first_frame_at - handoff_from)
+        if trace is not None:
+            trace.add("first_frame", source.first_frame_at - played_at)
+            trace.finish(source.first_frame_at)
 
     async def audio_player_task(self) -> None:
         """Audio player task"""
         while True:
             self.next.clear()
+            self._cancel_prefetch()
+            ended_at, self._ended_at = self._ended_at, None
 
-            if self.loop:
-                song = await self.redo_song()
-                self.current.source = song.source
-            else:
+            if not self.loop or self.current is None:
+                if self.songs.empty():
+                    ended_at = None
                 try:
                     async with timeout(180):
                         self.current = await self.songs.get()
@@ -130,16 +432,64 @@ class VoiceState:
                     await self.stop()
                     return
 
-            self.current.source.volume = self._volume
+            handoff_from = ended_at or time.monotonic()
+            trace = self.current.trace
+            if trace is not None:
+                trace.since("queue", trace.enqueued_at)
+            self._release_warm(keep=self.current)
+            warm = self.current.source is not None
+            if not warm:
+                start, self.resume_position = self.resume_position, 0.0
+                try:
+                    self.current.source = await self.create_source(
+                        self.current, start=start, shared=True
+                    )
+                except (YTDLError, StreamBudgetError, discord.ClientException) as err:
+                    self.loop = False
+                    self.current.trace = None
+                    await self._notify(
+                        self.current.channel,
+                        f"Couldn't play **{self.current.title}**: {err}",
+                    )
+                    continue
+
+            self.current.trace = None
+            if not self.voice:
+                self.current.source.cleanup()
+                self.current.source = None
+                continue
+
+            if self.current.source.live_volume:
+                self.current.source.volume = self._volume
+            self.current.source.on_first_frame = functools.partial(
+                self._record_handoff, handoff_from, warm, trace, time.monotonic()
+            )
             self.voice.play(self.current.source, after=self.play_next_song)
+            self.touch()
+            if not isinstance(self.current.source, CachedSource):
+                get_audio_cache().note_play(self.current)
+            if self.prefetch_depth > 0:
+                self._prefetch_task = self.bot.loop.create_task(self.prefetch())
             if not self.loop:
-                await self.current.source.channel.send(
-                    "Now playing:", embed=self.current.make_song_embed()
+                await self._notify(
+                    self.current.channel,
+                    "Now playing:",
+                    embed=self.current.make_song_embed(),
                 )
             await self.next.wait()
+            self.current.source = None
+
+    @staticmethod
+    async def _notify(channel: discord.abc.Messageable, content: str, **kwargs) -> None:
+        """Send message about playback, a failed send must not stop the player"""
+        try:
+            await channel.send(content, **kwargs)
+        except discord.HTTPException:
+            pass
 
     def play_next_song(self, error: Exception = None) -> None:
-        """Play next song"""
+        """Play next song, called from the player thread"""
+        self._ended_at = self.last_active = time.monotonic()
+        self.bot.loop.call_soon_threadsafe(self.next.set)
         if error:
             raise VoiceError(str(error))
-        self.next.set()
@@ -1,122 +1,530 @@
 """Module with YTDL Source class for music cog"""
-import asyncio
-import functools
+import audioop
+import time
+from collections import namedtuple
+from typing import Callable, Hashable, Optional, Union
+from urllib.parse import parse_qs, urlparse
 
 import discord
 import yt_dlp
-from discord.ext import commands
 
-yt_dlp.utils.bug_reports_message = lambda: ""
+from core.cache import TTLCache
+from core.config import get_config
+from core.singleflight import SingleFlight
+
+from . import decodehub, extractor
+from .audiocache import get_audio_cache
+from .extractionpool import ExtractionError, get_extraction_pool
+from .playtrace import PlayTrace
+from .trackindex import TrackIndex
 
 
 class YTDLError(Exception):
     """Exception for YTDL errors"""
 
 
-class YTDLSource(discord.PCMVolumeTransformer):
-    """Class for YTDL Source"""
-
-    YTDL_OPTIONS = {
-        "format": "bestaudio/best",
-        "extractaudio": True,
-        "audioformat": "mp3",
-        "outtmpl": "%(extractor)s-%(id)s-%(title)s.%(ext)s",
-        "restrictfilenames": True,
-        "noplaylist": True,
-        "nocheckcertificate": True,
-        "ignoreerrors": False,
-        "logtostderr": False,
-        "quiet": True,
-        "no_warnings": True,
-        "default_search": "auto",
-    }
+# Unresolved playlist with entries as (webpage url, title, duration) tuples
+Playlist = namedtuple("Playlist", ("title", "entries"))
+
+
+class TrackedSource(discord.AudioSource):
+    """Mixin for audio sources playing a queued song
+
+    Counts frames read by the player and notifies the owner of the
+    source about its first frame and its cleanup. Listed before the
+    audio source class it tracks, so read and cleanup wrap its methods.
+    """
+
+    # Sources that can change volume while playing, others need a restart
+    live_volume = False
+
+    def _track(
+        self,
+        song,
+        on_cleanup: Optional[Callable[["TrackedSource"], None]],
+        start: float = 0.0,
+    ) -> None:
+        """Init tracking of the source starting at given offset in seconds"""
+        self.song = song
+        self.requester = song.requester
+        self.channel = song.channel
+        self.start = start
+        self.frames = 0
+        self.first_frame_at = None
+        self.on_first_frame = None
+        self._on_cleanup = on_cleanup
+
+    def __str__(self) -> str:
+        return f"**{self.song.title}** by **{self.song.uploader}**"
+
+    @property
+    def position(self) -> float:
+        """Playback position in seconds"""
+        return self.start + self.frames * 0.02
+
+    def read(self) -> bytes:
+        """Read 20 ms of audio, called from the player thread"""
+        if self.first_frame_at is None:
+            self.first_frame_at = time.monotonic()
+            if self.on_first_frame is not None:
+                self.on_first_frame(self)
+        self.frames += 1
+        return super().read()
+
+    @property
+    def pid(self) -> Optional[int]:
+        """Pid of the ffmpeg process or None if it was already cleaned up"""
+        process = getattr(getattr(self, "original", self), "_process", None)
+        return process.pid if process else None
+
+    def cleanup(self) -> None:
+        """Kill the ffmpeg process and notify the owner of the source"""
+        super().cleanup()
+        if self._on_cleanup is not None:
+            on_cleanup, self._on_cleanup = self._on_cleanup, None
+            on_cleanup(self)
+
+
+class CachedSource(TrackedSource, discord.FFmpegOpusAudio):
+    """Source playing a song from the on-disk Opus cache
+
+    At the volume the file was encoded with, Opus packets are passed
+    through to discord as they are. Other volumes are applied by ffmpeg,
+    which encodes Opus itself, so nothing is done per frame in Python.
+    """
+
+    def __init__(
+        self,
+        song,
+        path: str,
+        *,
+        volume: float,
+        file_volume: float,
+        bitrate: int,
+        start: float = 0.0,
+        on_cleanup: Optional[Callable[[TrackedSource], None]] = None,
+    ) -> None:
+        passthrough = abs(volume - file_volume) < 0.005
+        super().__init__(
+            path,
+            bitrate=bitrate,
+            codec="opus" if passthrough else None,
+            before_options=f"-ss {start:.2f}" if start else None,
+            options=None if passthrough else f"-af volume={volume / file_volume:.3f}",
+        )
+        self.volume = volume
+        self._track(song, on_cleanup, start)
+
+
+class OpusSource(TrackedSource, discord.FFmpegOpusAudio):
+    """Source streaming a song through ffmpeg straight to Opus
+
+    Volume and loudness normalization are part of the ffmpeg filter graph,
+    so the player sends the encoded packets without any per-frame work
+    in Python.
+    """
+
+    def __init__(
+        self,
+        song,
+        ffmpeg_options: dict,
+        *,
+        volume: float,
+        start: float = 0.0,
+        on_cleanup: Optional[Callable[[TrackedSource], None]] = None,
+    ) -> None:
+        super().__init__(song.stream_url, **ffmpeg_options)
+        self.volume = volume
+        self._track(song, on_cleanup, start)
+
+
+class SharedStream(discord.AudioSource):
+    """Audio source reading frames from a decoder shared between guilds
+
+    PCM frames are scaled to the volume of each subscriber, Opus frames
+    have the volume of the decoder. A subscriber that fell out of the
+    decoder buffer gets silence and reports lag, so its owner can replace
+    it with a private source, or it skips ahead after a second.
+    """
+
+    LAG_GRACE_FRAMES = 50
+
+    def __init__(
+        self,
+        hub: decodehub.DecodeHub,
+        volume: float,
+        on_lag: Optional[Callable[["SharedStream"], None]] = None,
+    ) -> None:
+        self.hub = hub
+        self.volume = volume
+        self.cursor = 0
+        self.lagging = 0
+        self.on_lag = on_lag
+        self._subscribed = True
+
+    def is_opus(self) -> bool:
+        return self.hub.is_opus()
+
+    def read(self) -> bytes:
+        """Read next frame of the shared decoder"""
+        data = self.hub.read(self.cursor)
+        if data is None:
+            if self.lagging == 0 and self.on_lag is not None:
+                self.on_lag(self)
+            self.lagging += 1
+            if self.lagging > self.LAG_GRACE_FRAMES:
+                self.cursor = self.hub.base
+                self.lagging = 0
+            return self.hub.silence
+        self.cursor += 1
+        self.lagging = 0
+        if data and not self.hub.is_opus():
+            data = audioop.mul(data, 2, min(self.volume, 2.0))
+        return data
+
+    def cleanup(self) -> None:
+        """Leave the shared decoder, the last subscriber kills its process"""
+        if self._subscribed:
+            self._subscribed = False
+            self.hub.unsubscribe()
+
+
+class SharedSource(TrackedSource, SharedStream):
+    """Source playing a song from a shared decoder"""
+
+    def __init__(
+        self,
+        song,
+        hub: decodehub.DecodeHub,
+        *,
+        volume: float,
+        on_cleanup: Optional[Callable[[TrackedSource], None]] = None,
+        on_lag: Optional[Callable[[TrackedSource], None]] = None,
+    ) -> None:
+        super().__init__(hub, volume, on_lag)
+        self._track(song, on_cleanup)
+
+    @property
+    def live_volume(self) -> bool:
+        """PCM frames are scaled per subscriber, Opus ones are not"""
+        return not self.hub.is_opus()
+
+    @property
+    def position(self) -> float:
+        """Playback position in seconds, not advanced by silence while lagging"""
+        return self.cursor * 0.02
+
+    @property
+    def pid(self) -> Optional[int]:
+        """Pid of the shared ffmpeg process"""
+        return self.hub.pid
+
+
+class YTDLSource(TrackedSource, discord.PCMVolumeTransformer):
+    """Class for YTDL Source
+
+    Decodes songs to PCM and scales their volume in Python, which allows
+    changing the volume while playing.
+    """
+
+    live_volume = True
+
+    YTDL_OPTIONS = extractor.YTDL_OPTIONS
 
     FFMPEG_OPTIONS = {
         "before_options": "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5",
         "options": "-vn",
     }
 
-    ytdl = yt_dlp.YoutubeDL(YTDL_OPTIONS)
-    ytdl.cache.remove()
+    LOUDNORM_FILTER = "loudnorm=I=-16:TP=-1.5:LRA=11"
+
+    # Parts of yt-dlp info not needed for playback, dropped before caching
+    HEAVY_INFO_KEYS = (
+        "formats",
+        "requested_formats",
+        "thumbnails",
+        "subtitles",
+        "automatic_captions",
+        "chapters",
+        "heatmap",
+    )
+
+    # Search hits stay valid long after the stream urls they resolve to expire
+    search_cache = TTLCache(
+        maxsize=get_config().music.get("search_cache_size", 1024),
+        ttl=get_config().music.get("search_cache_ttl", 21600),
+    )
+    info_cache = TTLCache(
+        maxsize=get_config().music.get("info_cache_size", 256),
+        ttl=get_config().music.get("stream_url_ttl", 1800),
+    )
+    # Frames kept by shared decoders, and how far into the song others may join
+    shared_buffer_frames = int(get_config().music.get("shared_buffer", 10) / 0.02)
+    shared_join_frames = int(get_config().music.get("shared_join_window", 2) / 0.02)
+    track_index = TrackIndex(
+        maxsize=get_config().music.get("track_index_size", 5000),
+        min_score=get_config().music.get("track_index_min_score", 0.85),
+    )
+    # Guilds playing the same query or link at once share one extraction
+    searches = SingleFlight("music_search")
+    resolutions = SingleFlight("music_resolve")
 
     def __init__(
         self,
-        ctx: commands.Context,
+        song,
         source: discord.FFmpegPCMAudio,
         *,
-        data: dict,
         volume: float = 0.5,
+        start: float = 0.0,
+        on_cleanup: Optional[Callable[[TrackedSource], None]] = None,
     ) -> None:
         super().__init__(source, volume)
+        self._track(song, on_cleanup, start)
 
-        self.requester = ctx.author
-        self.channel = ctx.channel
-        self.data = data
-
-        self.uploader = data.get("uploader")
-        self.uploader_url = data.get("uploader_url")
-        date = data.get("upload_date")
-        self.upload_date = date[6:8] + "." + date[4:6] + "." + date[0:4]
-        self.title = data.get("title")
-        self.thumbnail = data.get("thumbnail")
-        self.description = data.get("description")
-        self.duration = self.parse_duration(int(data.get("duration")))
-        self.tags = data.get("tags")
-        self.url = data.get("webpage_url")
-        self.views = data.get("view_count")
-        self.likes = data.get("like_count")
-        self.dislikes = data.get("dislike_count")
-        self.stream_url = data.get("url")
+    @staticmethod
+    def normalize_query(search: str) -> str:
+        """Normalize search query for use as a cache key
 
-    def __str__(self) -> str:
-        return f"**{self.title}** by **{self.uploader}**"
+        Urls are kept verbatim, as video and playlist ids are case-sensitive.
+        """
+        if urlparse(search.strip()).scheme in ("http", "https"):
+            return search.strip()
+        return " ".join(search.split()).casefold()
 
     @classmethod
-    async def create_source(cls, ctx: commands.Context, search: str) -> "YTDLSource":
-        """Creates a YTDL Source"""
-        loop = asyncio.get_event_loop()
+    def stream_ttl(cls, info: dict) -> float:
+        """Seconds the stream url of resolved info can be used for
 
-        partial = functools.partial(
-            cls.ytdl.extract_info, search, download=False, process=False
-        )
-        data = await loop.run_in_executor(None, partial)
+        Capped by the expire parameter some extractors put into stream urls.
+        """
+        ttl = cls.info_cache.ttl
+        expire = parse_qs(urlparse(info.get("url") or "").query).get("expire")
+        if expire and expire[0].isdigit():
+            ttl = min(ttl, int(expire[0]) - time.time() - 60)
+        return ttl
 
-        if data is None:
-            raise YTDLError(f"Couldn't find anything that matches `{search}`")
+    @classmethod
+    async def _run(cls, guild_id: Hashable, func, *args):
+        """Run extraction function in the extraction process pool"""
+        try:
+            return await get_extraction_pool().run(guild_id, func, *args)
+        except (ExtractionError, yt_dlp.utils.YoutubeDLError) as err:
+            raise YTDLError(str(err)) from err
+        except Exception as err:
+            # Broken worker pool or a result that could not be unpickled
+            raise YTDLError("Looking up the song failed, try again.") from err
 
-        if "entries" not in data:
-            process_info = data
-        else:
-            process_info = None
-            for entry in data["entries"]:
-                if entry:
-                    process_info = entry
-                    break
+    @classmethod
+    async def extract(
+        cls,
+        search: str,
+        guild_id: Hashable = None,
+        playlist_limit: int = 0,
+        trace: Optional[PlayTrace] = None,
+    ) -> Union[dict, Playlist]:
+        """Search for a query or url and return the resolved yt-dlp info
 
-            if process_info is None:
+        Queries matching a previously resolved track return its indexed
+        metadata without a stream url, which is resolved before playback.
+        With playlist limit set, playlist urls return an unresolved Playlist.
+        """
+        started = time.monotonic()
+        key = cls.normalize_query(search)
+        webpage_url = cls.search_cache.get(key)
+        if webpage_url is None:
+            if search.startswith(("http://", "https://")):
+                if search in cls.track_index:
+                    webpage_url = search
+            else:
+                info = cls.track_index.search(search)
+                if info is not None:
+                    if trace is not None:
+                        trace.since("search", started)
+                    return info
+        if webpage_url is not None:
+            info = cls.info_cache.get(webpage_url) or cls.track_index.info(webpage_url)
+            if info is not None:
+                if trace is not None:
+                    trace.since("search", started)
+                return info
+        else:
+            webpage_url = await cls.searches.do(
+                (key, playlist_limit),
+                cls._run,
+                guild_id,
+                extractor.search,
+                search,
+                playlist_limit,
+            )
+            if webpage_url is None:
                 raise YTDLError(f"Couldn't find anything that matches `{search}`")
+            if isinstance(webpage_url, dict):
+                if not webpage_url["entries"]:
+                    raise YTDLError(f"Playlist `{search}` has no playable entries")
+                return Playlist(webpage_url["title"], webpage_url["entries"])
 
-        webpage_url = process_info["webpage_url"]
-        partial = functools.partial(cls.ytdl.extract_info, webpage_url, download=False)
-        processed_info = await loop.run_in_executor(None, partial)
+        resolve_started = time.monotonic()
+        if trace is not None:
+            trace.add("search", resolve_started - started)
+        info = await cls.resolve(webpage_url, guild_id)
+        if trace is not None:
+            trace.since("resolve", resolve_started)
+        cls.search_cache.set(key, info.get("webpage_url") or webpage_url)
+        cls.track_index.add(info, alias=search)
+        return info
 
-        if processed_info is None:
+    @classmethod
+    async def resolve(cls, webpage_url: str, guild_id: Hashable = None) -> dict:
+        """Fully resolve a webpage url including its stream url
+
+        Resolved info is cached until its stream url is about to expire.
+        """
+        info = cls.info_cache.get(webpage_url)
+        if info is not None:
+            return info
+        return await cls.resolutions.do(
+            webpage_url, cls._resolve, webpage_url, guild_id
+        )
+
+    @classmethod
+    async def _resolve(cls, webpage_url: str, guild_id: Hashable) -> dict:
+        """Resolve a webpage url in the extraction pool and cache its info"""
+        info = await cls._run(
+            guild_id, extractor.resolve, webpage_url, cls.HEAVY_INFO_KEYS
+        )
+        if info is None:
             raise YTDLError(f"Couldn't fetch `{webpage_url}`")
+        if not info:
+            raise YTDLError(f"Couldn't retrieve any matches for `{webpage_url}`")
 
-        if "entries" not in processed_info:
-            info = processed_info
+        cls.track_index.add(info)
+        ttl = cls.stream_ttl(info)
+        info["stream_expires_at"] = time.monotonic() + ttl
+        cls.info_cache.set(webpage_url, info, ttl=ttl)
+        if info.get("webpage_url", webpage_url) != webpage_url:
+            cls.info_cache.set(info["webpage_url"], info, ttl=ttl)
+        return info
+
+    @classmethod
+    async def refresh(cls, song) -> None:
+        """Re-resolve the stream url of a song if it might have expired"""
+        if time.monotonic() >= song.expires_at:
+            song.update(await cls.resolve(song.url, song.channel.guild.id))
+
+    @classmethod
+    async def create_source(
+        cls,
+        song,
+        *,
+        volume: float = 0.5,
+        start: float = 0.0,
+        mode: str = "pcm",
+        loudnorm: bool = False,
+        on_cleanup: Optional[Callable[[TrackedSource], None]] = None,
+        shared: bool = False,
+        on_lag: Optional[Callable[[TrackedSource], None]] = None,
+    ) -> TrackedSource:
+        """Creates an audio source for a song, spawning its ffmpeg process
+
+        Songs in the audio cache are played from disk without resolving
+        their stream url, taking their metadata from the cache. Otherwise
+        mode "pcm" creates a YTDLSource and mode "opus" an OpusSource.
+        Shared sources from the start of a song join a decoder other
+        guilds just started, or start a new one.
+        """
+        trace = song.trace
+        started = time.monotonic()
+        cache = get_audio_cache()
+        path = cache.lookup(song.url)
+        shared = shared and not start
+        key = (song.url, mode, loudnorm, volume if mode == "opus" else None)
+        hub = decodehub.join_hub(key) if shared and path is None else None
+        if path is not None:
+            track = cache.track(song.url)
+            if track is not None:
+                song.track = track
+            source = CachedSource(
+                song,
+                path,
+                volume=volume,
+                file_volume=cache.volume,
+                bitrate=cache.bitrate,
+                start=start,
+                on_cleanup=on_cleanup,
+            )
+        elif hub is not None:
+            source = SharedSource(
+                song, hub, volume=volume, on_cleanup=on_cleanup, on_lag=on_lag
+            )
         else:
-            info = None
-            while info is None:
-                try:
-                    info = processed_info["entries"].pop(0)
-                except IndexError as err:
-                    raise YTDLError(
-                        f"Couldn't retrieve any matches for `{webpage_url}`"
-                    ) from err
+            await cls.refresh(song)
+            if trace is not None:
+                trace.since("resolve", started)
+                started = time.monotonic()
+            source = cls._spawn(
+                song,
+                volume=volume,
+                start=start,
+                mode=mode,
+                loudnorm=loudnorm,
+                on_cleanup=on_cleanup,
+                shared_key=key if shared else None,
+                on_lag=on_lag,
+            )
+        if trace is not None:
+            trace.since("spawn", started)
+        return source
+
+    @classmethod
+    def _spawn(
+        cls,
+        song,
+        *,
+        volume: float,
+        start: float,
+        mode: str,
+        loudnorm: bool,
+        on_cleanup: Optional[Callable[[TrackedSource], None]],
+        shared_key: Optional[Hashable],
+        on_lag: Optional[Callable[[TrackedSource], None]],
+    ) -> TrackedSource:
+        """Spawn ffmpeg streaming a resolved song"""
+        before_options = cls.FFMPEG_OPTIONS["before_options"]
+        if start:
+            before_options += f" -ss {start:.2f}"
+        filters = [cls.LOUDNORM_FILTER] if loudnorm else []
+        if mode == "opus":
+            filters.append(f"volume={volume:.3f}")
+        options = cls.FFMPEG_OPTIONS["options"]
+        if filters:
+            options += " -af " + ",".join(filters)
+        ffmpeg_options = {"before_options": before_options, "options": options}
 
+        if shared_key is not None:
+            if mode == "opus":
+                decoder = discord.FFmpegOpusAudio(song.stream_url, **ffmpeg_options)
+            else:
+                decoder = discord.FFmpegPCMAudio(song.stream_url, **ffmpeg_options)
+            hub = decodehub.open_hub(
+                shared_key, decoder, cls.shared_buffer_frames, cls.shared_join_frames
+            )
+            return SharedSource(
+                song, hub, volume=volume, on_cleanup=on_cleanup, on_lag=on_lag
+            )
+        if mode == "opus":
+            return OpusSource(
+                song,
+                ffmpeg_options,
+                volume=volume,
+                start=start,
+                on_cleanup=on_cleanup,
+            )
         return cls(
-            ctx, discord.FFmpegPCMAudio(info["url"], **cls.FFMPEG_OPTIONS), data=info
+            song,
+            discord.FFmpegPCMAudio(song.stream_url, **ffmpeg_options),
+            volume=volume,
+            start=start,
+            on_cleanup=on_cleanup,
         )
 
     @staticmethod
@@ -1,10 +1,17 @@
 """nhentai bot commands cog module"""
 import discord
 from discord.ext import commands
-from hentai import Hentai, Utils
+from hentai import Hentai, Sort
 from core.basecog import BaseCog
+from core.http import HTTPError, HTTPStatusError, get_http_client
+from core.singleflight import SingleFlight
 from .doujin import Doujin
 
+NHENTAI_URL = "https://nhentai.net"
+
+# Users asking for the same numbers at once share one api request
+_galleries = SingleFlight("nhentai")
+
 
 def make_doujin_embed(doujin: Doujin) -> discord.Embed:
     """Make an embed from a Doujin object"""
@@ -39,6 +46,16 @@ class Nhentai(BaseCog):
         if isinstance(error, commands.CheckFailure):
             await ctx.send("Shhhh. Not here. Kids are around.")
 
+    async def _send_doujin(self, ctx: commands.Context, gallery: dict) -> None:
+        """Send custom doujin embed of gallery json from nhentai api"""
+        doujin = Doujin(Hentai(json=gallery))
+        embed = make_doujin_embed(doujin)
+        img_author = discord.File(
+            "assets/images/logos/logo-nhentai.png",
+            filename="logo-nhentai.png",
+        )
+        await ctx.send(file=img_author, embed=embed)
+
     @commands.command(name="numbers")
     async def _numbers(self, ctx: commands.Context, numbers) -> None:
         """Returns custom doujin embed from ID of doujin on nhentai"""
@@ -47,27 +64,33 @@ class Nhentai(BaseCog):
         except ValueError:
             await ctx.send("Those are not numbers buddy")
             return
-        if Hentai.exists(numbers):
-            doujin = Doujin(Hentai(numbers))
-            embed = make_doujin_embed(doujin)
-            img_author = discord.File(
-                "assets/images/logos/logo-nhentai.png",
-                filename="logo-nhentai.png",
-            )
-            await ctx.send(file=img_author, embed=embed)
-        else:
+        try:
+            url = f"{NHENTAI_URL}/api/gallery/{numbers}"
+            gallery = await _galleries.do(url, get_http_client().get_json, url)
+        except HTTPStatusError as error:
+            if error.status != 404:
+                raise
             await ctx.send("You got the wrong numbers buddy")
+            return
+        await self._send_doujin(ctx, gallery)
 
     @commands.command()
     async def numbers_random(self, ctx: commands.Context) -> None:
-        """Passes output of hentai.Utils random to _numbers command"""
-        doujin = Utils.get_random_hentai()
-        await ctx.invoke(self._numbers, doujin.id)
+        """Passes ID of random doujin to _numbers command"""
+        response = await get_http_client().get(f"{NHENTAI_URL}/random")
+        await ctx.invoke(self._numbers, response.url.rstrip("/").split("/")[-1])
 
     @commands.command()
     async def numbers_search(self, ctx: commands.Context, *, query: str) -> None:
-        """Searches for doujin by query and passes output to _numbers command"""
-        doujins = Utils.search_by_query(query)
-        for doujin in doujins:
-            await ctx.invoke(self._numbers, doujin.id)
+        """Searches for doujin by query and returns embed of the most popular"""
+        try:
+            results = await get_http_client().get_json(
+                f"{NHENTAI_URL}/api/galleries/search",
+                params={"query": query, "page": 1, "sort": Sort.Popular.value},
+            )
+        except HTTPError:
+            results = {}
+        if not results.get("result"):
+            await ctx.send("Nothing found buddy")
             return
+        await self._send_doujin(ctx, results["result"][0])
@@ -1,22 +1,55 @@
 """News bot loop and commands cog module"""
-import json
+import asyncio
 import os
 import discord
-import requests
 import xml.etree.ElementTree as ET
 from bs4 import BeautifulSoup
 from discord.ext import commands, tasks
 from core.basecog import BaseCog
+from core.fanout import Post, make_fanout
+from core.http import HTTPError, get_http_client
+from core.storage import get_storage
 from .news import News
 
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS news_reposts (
+    url TEXT PRIMARY KEY,
+    age INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS news_channels (
+    channel_id INTEGER PRIMARY KEY
+);
+"""
+INSERT_REPOST = "INSERT OR REPLACE INTO news_reposts (url, age) VALUES (?, ?)"
+INSERT_CHANNEL = "INSERT OR IGNORE INTO news_channels (channel_id) VALUES (?)"
+DELETE_CHANNEL = "DELETE FROM news_channels WHERE channel_id = ?"
+
+
+def _convert_news_reposts(news_reposts: dict) -> list:
+    """Statements importing news reposts from the old json file"""
+    return [(INSERT_REPOST, (url, age)) for url, age in news_reposts.items()]
+
+
+def _convert_news_channels(news_channels: list) -> list:
+    """Statements importing news channels from the old json file"""
+    return [(INSERT_CHANNEL, (channel_id,)) for channel_id in news_channels]
+
+
+def _parse_preview_image_url(content: bytes) -> str:
+    """Parse preview image url from news page"""
+    soup = BeautifulSoup(content, "html.parser")
+    preview_image = soup.find("meta", property="og:image")
+    return preview_image["content"] if preview_image else None
+
 
 async def _get_preview_image_url(url: str) -> str:
     """Get preview image url from news url"""
-    response = requests.get(url)
-    if response.status_code == 200:
-        soup = BeautifulSoup(response.content, "html.parser")
-        preview_image_url = soup.find("meta", property="og:image")["content"]
-        return preview_image_url
+    try:
+        response = await get_http_client().get(url)
+    except HTTPError:
+        return None
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, _parse_preview_image_url, response.body)
 
 
 async def _make_new_embed(news) -> discord.Embed:
@@ -31,7 +64,9 @@ async def _make_new_embed(news) -> discord.Embed:
         icon_url="attachment://logo-novinkycz.png",
     )
     embed.set_footer(text = f"Datum zprávy: {news.publication_date}")
-    embed.set_image(url = await _get_preview_image_url(news.loc))
+    preview_image_url = await _get_preview_image_url(news.loc)
+    if preview_image_url:
+        embed.set_image(url=preview_image_url)
     return embed
 
 
@@ -46,73 +81,73 @@ class Novinkycz(BaseCog):
         }
 
         self.news_repost_json_path = self.dir_path + "/news_reposts.json"
-        self.news_reposts = self._get_news_reposts()
+        self.news_reposts = {}
 
         self.news_channels_json_path = self.dir_path + "/news_channels.json"
-        self.news_channels = self._get_news_channels()
-
-    def _get_news_reposts(self) -> dict:
-        """Get news repost from news repost local json file"""
-        try:
-            with open(
-                self.news_repost_json_path, "r", encoding="utf-8"
-            ) as news_reposts_file:
-                news_reposts = json.load(news_reposts_file)
-        except FileNotFoundError:
-            self.logger.warning(
-                "Could not find news_repost.json file, making new one..."
-            )
-            with open(
-                self.news_repost_json_path, "w", encoding="utf-8"
-            ) as news_reposts_file:
-                news_reposts = {}
-                json.dump(news_reposts, news_reposts_file, indent=4)
-        return news_reposts
-
-    def _get_news_channels(self) -> list:
-        """Get news channels from news channels local json file"""
-        try:
-            with open(
-                self.news_channels_json_path, "r", encoding="utf-8"
-            ) as news_channels_file:
-                news_channels = json.load(news_channels_file)
-        except FileNotFoundError:
-            self.logger.warning(
-                "Could not find news_channels.json file, making new one..."
+        self.news_channels = []
+
+        self.storage = get_storage()
+        self.fanout = make_fanout(bot, "novinkycz")
+        self.state_loaded = self.bot.loop.create_task(self._load_state())
+
+    async def cog_before_invoke(self, ctx: commands.Context) -> commands.Context:
+        """Wait for news channels to be loaded before commands"""
+        await self.state_loaded
+        return await super().cog_before_invoke(ctx)
+
+    async def _load_state(self) -> None:
+        """Load news reposts and channels from storage, importing json files once"""
+        await self.storage.create_tables(SCHEMA)
+        await self.storage.migrate(
+            "novinkycz.news_reposts",
+            self.news_repost_json_path,
+            _convert_news_reposts,
+        )
+        await self.storage.migrate(
+            "novinkycz.news_channels",
+            self.news_channels_json_path,
+            _convert_news_channels,
+        )
+        self.news_reposts = dict(
+            await self.storage.fetch_all("SELECT url, age FROM news_reposts")
+        )
+        self.news_channels = [
+            channel_id
+            for channel_id, in await self.storage.fetch_all(
+                "SELECT channel_id FROM news_channels"
             )
-            with open(
-                self.news_channels_json_path, "w", encoding="utf-8"
-            ) as news_channels_file:
-                news_channels = []
-                json.dump(news_channels, news_channels_file, indent=4)
-        return news_channels
-
-    def _get_news(self) -> dict:
-        """Get news from url"""
-        self.logger.debug("Fetching news...")
-        respone = requests.get(self.news_url)
+        ]
+
+    def _parse_news(self, content: bytes) -> dict:
+        """Parse news from sitemap"""
         news = {}
-        if respone.status_code == 200:
-            root = ET.fromstring(respone.content)
-            for new in root.findall("loc:url", self.ns):
-                parsed_new = News(new, self.ns)
-                news[parsed_new.loc] = parsed_new
+        root = ET.fromstring(content)
+        for new in root.findall("loc:url", self.ns):
+            parsed_new = News(new, self.ns)
+            news[parsed_new.loc] = parsed_new
         return news
 
-    def _save_news_reposts(self) -> None:
-        """Save repost to repost local json file"""
-        with open(self.news_repost_json_path, "w", encoding="utf-8") as reposts_file:
-            json.dump(self.news_reposts, reposts_file, indent=4)
+    async def _get_news(self) -> dict:
+        """Get news from url"""
+        self.logger.debug("Fetching news...")
+        try:
+            response = await get_http_client().get(self.news_url)
+        except HTTPError as error:
+            self.logger.warning("Could not fetch news: %s", error)
+            return {}
+        return await self.bot.loop.run_in_executor(
+            None, self._parse_news, response.body
+        )
 
-    def _save_news_channels(self) -> None:
-        """Save news repost to local json file"""
-        with open(
-            self.news_channels_json_path, "w", encoding="utf-8"
-        ) as news_channels_file:
-            json.dump(self.news_channels, news_channels_file, indent=4)
+    def _remove_news_channel(self, channel_id: int) -> None:
+        """Unsubscribe channel from news"""
+        self.news_channels.remove(channel_id)
+        self.storage.execute(DELETE_CHANNEL, (channel_id,))
 
     def _increment_news(self) -> None:
         """Increment news"""
+        self.storage.execute("UPDATE news_reposts SET age = age + 1")
+        self.storage.execute("DELETE FROM news_reposts WHERE age >= 336")
         for news_repost in self.news_reposts.copy():
             self.news_reposts[news_repost] += 1
             if self.news_reposts[news_repost] >= 336:
@@ -129,33 +164,30 @@ class Novinkycz(BaseCog):
     @tasks.loop(hours=1)
     async def news_loop(self) -> None:
         """News loop"""
+        await self.state_loaded
         self.logger.info("News loop started")
         self._increment_news()
-        news = self._get_news()
+        news = await self._get_news()
         self.logger.debug("News fetched.")
         for new in news:
             if news[new].loc not in self.news_reposts:
                 self.logger.debug("Found new news: %s", news[new].title)
                 self.news_reposts[news[new].loc] = 0
-                embed = await _make_new_embed(news[new])
-                img_author = discord.File(
-                    "assets/images/logos/logo-novinkycz.png",
-                    filename="logo-novinkycz.png",
+                self.storage.execute(INSERT_REPOST, (news[new].loc, 0))
+                post = await Post.with_files(
+                    embed=await _make_new_embed(news[new]),
+                    files={
+                        "logo-novinkycz.png": "assets/images/logos/logo-novinkycz.png"
+                    },
                 )
-                for channel_id in self.news_channels.copy():
-                    try:
-                        channel = self.bot.get_channel(channel_id)
-                        if not channel:
-                            self.news_channels.remove(channel_id)
-                            continue
-                    except discord.NotFound:
-                        self.logger.warning(
-                            "Could not find channel %s. Deleting...", channel_id
-                        )
-                        self.news_channels.remove(channel_id)
+                delivery = await self.fanout.dispatch(self.news_channels.copy(), post)
+                for channel_id in delivery.gone:
+                    if channel_id not in self.news_channels:
                         continue
-                    await channel.send(file=img_author, embed=embed)
-        self._save_news_reposts()
+                    self.logger.warning(
+                        "Could not find channel %s. Deleting...", channel_id
+                    )
+                    self._remove_news_channel(channel_id)
         self.logger.info("News loop finished")
 
     @commands.has_permissions(administrator=True)
@@ -164,7 +196,7 @@ class Novinkycz(BaseCog):
         """Add channel to list of channels to receive news form novinky.cz"""
         if ctx.channel.id not in self.news_channels:
             self.news_channels.append(ctx.channel.id)
-            self._save_news_channels()
+            self.storage.execute(INSERT_CHANNEL, (ctx.channel.id,))
             return await ctx.send(
                 f"{ctx.channel.mention} is now subscribed to novinky.cz"
             )
@@ -177,8 +209,7 @@ class Novinkycz(BaseCog):
     async def novinky_not_here(self, ctx: commands.Context) -> None:
         """Remove channel from list of channels to receive news form novinky.cz"""
         if ctx.channel.id in self.news_channels:
-            self.news_channels.remove(ctx.channel.id)
-            self._save_news_channels()
+            self._remove_news_channel(ctx.channel.id)
             return await ctx.send(
                 f"{ctx.channel.mention} is no longer subscribed to novinky.cz"
             )
@@ -21,6 +21,16 @@ class OpenAI(BaseCog):
         super().__init__(bot)
         self.chats = {}
         openai.api_key = self.config.openai["key"]
+        self.config.subscribe("openai", self._on_openai_config)
+
+    def cog_unload(self) -> None:
+        """Stop following openai config changes on unload"""
+        self.config.unsubscribe("openai", self._on_openai_config)
+
+    def _on_openai_config(self, openai_config) -> None:
+        """Use new API key after openai config changed"""
+        openai.api_key = openai_config["key"]
+        self.logger.info("OpenAI config changed, API key updated")
 
     def _get_chatlog_from_user(self, user, botname) -> ChatLog:
         """Get chatlog from user id."""
@@ -1,8 +1,22 @@
 """DiscordTogether bot commands cog module"""
 from discord.ext import commands
-from discord_together import DiscordTogether
+from discord.http import Route
+from discord_together.discordTogetherMain import defaultApplications
 from core.basecog import BaseCog
 
+ACTIVITIES = [
+    "youtube",
+    "chess",
+    "betrayal",
+    "fishing",
+    "letter-tile",
+    "word-snack",
+    "doodle-crew",
+    "spellcast",
+    "awkword",
+    "checkers",
+]
+
 
 class Party(BaseCog):
     """Bot discord_together commands"""
@@ -14,29 +28,28 @@ class Party(BaseCog):
             return False
         return True
 
+    async def _create_activity_invite(self, channel_id: int, activity: str) -> str:
+        """Create invite starting activity in voice channel, returns its link"""
+        route = Route("POST", "/channels/{channel_id}/invites", channel_id=channel_id)
+        payload = {
+            "max_age": 0,
+            "max_uses": 0,
+            "target_application_id": defaultApplications[activity],
+            "target_type": 2,
+            "temporary": False,
+        }
+        invite = await self.bot.http.request(route, json=payload)
+        return f"https://discord.gg/{invite['code']}"
+
     @commands.command()
     async def party(self, ctx: commands.Context, activity: str = "youtube") -> None:
         """Creates link for discord together activity"""
-        activities = [
-            "youtube",
-            "chess",
-            "betreyal",
-            "fishing",
-            "letter-tile",
-            "word-snack",
-            "doodle-crew",
-            "spellcast",
-            "awkword",
-            "checkers",
-        ]
-        if activity in activities:
-            together_control = await DiscordTogether(self.config.bot_token)
-            link = await together_control.create_link(
+        if activity in ACTIVITIES:
+            link = await self._create_activity_invite(
                 ctx.author.voice.channel.id, activity
             )
             await ctx.send(f"Click the blue link!\n{link}")
-            await together_control.close()
         else:
             await ctx.send(
-                "Invalid activity\nAvailable activities: " + ", ".join(activities)
+                "Invalid activity\nAvailable activities: " + ", ".join(ACTIVITIES)
             )
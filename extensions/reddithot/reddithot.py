@@ -1,11 +1,43 @@
 """Reddit bot loop and commands cog module"""
-import json
 import os
 import discord
 from discord.ext import commands, tasks
 from asyncpraw import Reddit
 from asyncprawcore.exceptions import Redirect
 from core.basecog import BaseCog
+from core.fanout import Post, make_fanout
+from core.storage import get_storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subreddit_channels (
+    subreddit TEXT NOT NULL,
+    channel_id INTEGER NOT NULL,
+    PRIMARY KEY (subreddit, channel_id)
+);
+CREATE TABLE IF NOT EXISTS reddit_reposts (
+    post_id TEXT PRIMARY KEY,
+    age INTEGER NOT NULL
+);
+"""
+INSERT_CHANNEL = (
+    "INSERT OR IGNORE INTO subreddit_channels (subreddit, channel_id) VALUES (?, ?)"
+)
+DELETE_CHANNEL = "DELETE FROM subreddit_channels WHERE subreddit = ? AND channel_id = ?"
+INSERT_REPOST = "INSERT OR REPLACE INTO reddit_reposts (post_id, age) VALUES (?, ?)"
+
+
+def _convert_subreddits(subreddits: dict) -> list:
+    """Statements importing subreddits from the old json file"""
+    return [
+        (INSERT_CHANNEL, (subreddit, channel_id))
+        for subreddit, channel_ids in subreddits.items()
+        for channel_id in channel_ids
+    ]
+
+
+def _convert_reposts(reposts: dict) -> list:
+    """Statements importing reposts from the old json file"""
+    return [(INSERT_REPOST, (post_id, age)) for post_id, age in reposts.items()]
 
 
 async def _make_reddit_embed(submission) -> discord.Embed:
@@ -45,59 +77,63 @@ class RedditHot(BaseCog):
         self.dir_path = os.path.dirname(os.path.realpath(__file__))
         self.subreddit_json_path = self.dir_path + "/subreddits.json"
         self.repost_json_path = self.dir_path + "/reposts.json"
-        self.subreddits = self._get_subreddits()
-        self.reposts = self._get_reposts()
-        self.reddit = Reddit(
-            client_id=self.config.reddit["id"],
-            client_secret=self.config.reddit["secret"],
-            username=self.config.reddit["username"],
-            password=self.config.reddit["password"],
-            user_agent=self.config.reddit["user_agent"],
+        self.subreddits = {}
+        self.reposts = {}
+        self.storage = get_storage()
+        self.fanout = make_fanout(bot, "reddithot")
+        self.state_loaded = self.bot.loop.create_task(self._load_state())
+        self.reddit = self._make_reddit(self.config.reddit)
+        self.config.subscribe("reddit", self._on_reddit_config)
+
+    def cog_unload(self) -> None:
+        """Stop following reddit config changes on unload"""
+        self.config.unsubscribe("reddit", self._on_reddit_config)
+
+    async def cog_before_invoke(self, ctx: commands.Context) -> commands.Context:
+        """Wait for subreddits to be loaded before commands"""
+        await self.state_loaded
+        return await super().cog_before_invoke(ctx)
+
+    @staticmethod
+    def _make_reddit(reddit_config) -> Reddit:
+        """Create read only reddit client from reddit config"""
+        reddit = Reddit(
+            client_id=reddit_config["id"],
+            client_secret=reddit_config["secret"],
+            username=reddit_config["username"],
+            password=reddit_config["password"],
+            user_agent=reddit_config["user_agent"],
         )
-        self.reddit.read_only = True
+        reddit.read_only = True
+        return reddit
 
-    def _get_subreddits(self) -> dict:
-        """Get subreddits from subreddits local json file"""
-        try:
-            with open(
-                self.subreddit_json_path, "r", encoding="utf-8"
-            ) as subreddits_file:
-                subreddits = json.load(subreddits_file)
-        except FileNotFoundError:
-            self.logger.warning(
-                "Could not find subreddits.json file, making new one..."
-            )
-            with open(
-                self.subreddit_json_path, "w", encoding="utf-8"
-            ) as subreddits_file:
-                subreddits = {}
-                json.dump(subreddits, subreddits_file, indent=4)
-        return subreddits
-
-    def _get_reposts(self) -> dict:
-        """Get repost from repost local json file"""
-        try:
-            with open(self.repost_json_path, "r", encoding="utf-8") as reposts_file:
-                reposts = json.load(reposts_file)
-        except FileNotFoundError:
-            self.logger.warning("Could not find repost.json file, making new one...")
-            with open(self.repost_json_path, "w", encoding="utf-8") as reposts_file:
-                reposts = {}
-                json.dump(reposts, reposts_file, indent=4)
-        return reposts
-
-    def _save_subreddits(self) -> None:
-        """Save subreddits to local json file"""
-        with open(self.subreddit_json_path, "w", encoding="utf-8") as subreddits_file:
-            json.dump(self.subreddits, subreddits_file, indent=4)
-
-    def _save_reposts(self) -> None:
-        """Save repost to repost local json file"""
-        with open(self.repost_json_path, "w", encoding="utf-8") as reposts_file:
-            json.dump(self.reposts, reposts_file, indent=4)
+    def _on_reddit_config(self, reddit_config) -> None:
+        """Replace reddit client after reddit config changed"""
+        old_reddit, self.reddit = self.reddit, self._make_reddit(reddit_config)
+        self.bot.loop.create_task(old_reddit.close())
+        self.logger.info("Reddit config changed, client recreated")
+
+    async def _load_state(self) -> None:
+        """Load subreddits and reposts from storage, importing old json files once"""
+        await self.storage.create_tables(SCHEMA)
+        await self.storage.migrate(
+            "reddithot.subreddits", self.subreddit_json_path, _convert_subreddits
+        )
+        await self.storage.migrate(
+            "reddithot.reposts", self.repost_json_path, _convert_reposts
+        )
+        for subreddit, channel_id in await self.storage.fetch_all(
+            "SELECT subreddit, channel_id FROM subreddit_channels"
+        ):
+            self.subreddits.setdefault(subreddit, []).append(channel_id)
+        self.reposts = dict(
+            await self.storage.fetch_all("SELECT post_id, age FROM reddit_reposts")
+        )
 
     def _increment_reposts(self) -> None:
         """Increment reposts for subreddit"""
+        self.storage.execute("UPDATE reddit_reposts SET age = age + 1")
+        self.storage.execute("DELETE FROM reddit_reposts WHERE age >= 48")
         for repost in self.reposts.copy():
             self.reposts[repost] += 1
             if self.reposts[repost] >= 48:
@@ -112,6 +148,7 @@ class RedditHot(BaseCog):
     @tasks.loop(hours=1)
     async def reddit_loop(self) -> None:
         """Reddit loop"""
+        await self.state_loaded
         self.logger.info("Reddit loop started")
         self._increment_reposts()
 
@@ -127,23 +164,26 @@ class RedditHot(BaseCog):
                     if f"{praw_subreddit.id}-{submission.id}" not in self.reposts:
                         self.logger.debug("Found new submission: %s", submission.id)
                         self.reposts[f"{praw_subreddit.id}-{submission.id}"] = 0
-                        embed = await _make_reddit_embed(submission)
-                        for channel_id in self.subreddits.copy()[subreddit]:
-                            try:
-                                channel = self.bot.get_channel(channel_id)
-                            except discord.NotFound:
-                                self.logger.warning(
-                                    "Could not find channel %s. Deleting...", channel_id
-                                )
-                                del self.subreddits[subreddit][channel_id]
+                        self.storage.execute(
+                            INSERT_REPOST, (f"{praw_subreddit.id}-{submission.id}", 0)
+                        )
+                        if submission.url.startswith("https://v.redd.it/"):
+                            post = Post("https://reddit.com" + submission.permalink)
+                        else:
+                            post = Post(embed=await _make_reddit_embed(submission))
+                        delivery = await self.fanout.dispatch(
+                            self.subreddits[subreddit].copy(), post
+                        )
+                        for channel_id in delivery.gone:
+                            if channel_id not in self.subreddits[subreddit]:
                                 continue
-                            if submission.url.startswith("https://v.redd.it/"):
-                                await channel.send("https://reddit.com" + submission.permalink)
-                            else:
-                                await channel.send(embed=embed)
+                            self.logger.warning(
+                                "Could not find channel %s. Deleting...", channel_id
+                            )
+                            self.subreddits[subreddit].remove(channel_id)
+                            self.storage.execute(DELETE_CHANNEL, (subreddit, channel_id))
                 except:
                     self.logger.exception("Error in submission %s, skipping...", submission.id)
-            self._save_reposts()
         self.logger.info("Reddit loop finished")
 
     @commands.has_permissions(administrator=True)
@@ -163,7 +203,7 @@ class RedditHot(BaseCog):
             self.subreddits.update({subreddit: []})
         if ctx.channel.id not in self.subreddits[subreddit]:
             self.subreddits[subreddit].append(ctx.channel.id)
-            self._save_subreddits()
+            self.storage.execute(INSERT_CHANNEL, (subreddit, ctx.channel.id))
             return await ctx.send(
                 f"{ctx.channel.mention} is now subscribed to {subreddit}"
             )
@@ -182,7 +222,7 @@ class RedditHot(BaseCog):
         subreddit = praw_subreddit.display_name
         if ctx.channel.id in self.subreddits[subreddit]:
             self.subreddits[subreddit].remove(ctx.channel.id)
-            self._save_subreddits()
+            self.storage.execute(DELETE_CHANNEL, (subreddit, ctx.channel.id))
             return await ctx.send(
                 f"{ctx.channel.mention} is no longer subscribed to {subreddit}"
             )
@@ -1,11 +1,42 @@
 """Roles bot commands and listeners cog module"""
 import os
-import json
 from typing import Optional
 import discord
 from discord.ext import commands, tasks
 from discord import RawReactionActionEvent
 from core.basecog import BaseCog
+from core.storage import get_storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reaction_messages (
+    message_id INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reaction_roles (
+    message_id INTEGER NOT NULL,
+    emoji TEXT NOT NULL,
+    role_id INTEGER NOT NULL,
+    PRIMARY KEY (message_id, emoji)
+);
+"""
+INSERT_MESSAGE = (
+    "INSERT OR REPLACE INTO reaction_messages (message_id, channel_id)"
+    " VALUES (?, ?)"
+)
+INSERT_ROLE = (
+    "INSERT OR REPLACE INTO reaction_roles (message_id, emoji, role_id)"
+    " VALUES (?, ?, ?)"
+)
+
+
+def _convert_reaction_messages(reaction_messages: dict) -> list:
+    """Statements importing reaction messages from the old json file"""
+    statements = []
+    for message_id, message in reaction_messages.items():
+        statements.append((INSERT_MESSAGE, (int(message_id), message["channel_id"])))
+        for emoji, role_id in message["emojies"].items():
+            statements.append((INSERT_ROLE, (int(message_id), emoji, role_id)))
+    return statements
 
 
 class MessageNotFound(Exception):
@@ -31,7 +62,14 @@ class Roles(BaseCog):
         super().__init__(bot)
         self.dir_path = os.path.dirname(os.path.realpath(__file__))
         self.reaction_messages_path = self.dir_path + "/reaction_messages.json"
-        self.reaction_messages = self._get_reaction_messages()
+        self.reaction_messages = {}
+        self.storage = get_storage()
+        self.state_loaded = self.bot.loop.create_task(self._load_reaction_messages())
+
+    async def cog_before_invoke(self, ctx: commands.Context) -> commands.Context:
+        """Wait for reaction messages to be loaded before commands"""
+        await self.state_loaded
+        return await super().cog_before_invoke(ctx)
 
     async def _message_in_messages(self, message: str) -> bool:
         """Check if message is in reaction messages"""
@@ -102,35 +140,46 @@ class Roles(BaseCog):
                         "Error in proccesing reaction, missing permissions."
                     )
 
-    def _get_reaction_messages(self):
-        """Get reaction messages from reaction messages local json file"""
-        try:
-            with open(
-                self.reaction_messages_path, "r", encoding="utf-8"
-            ) as messages_file:
-                return json.load(messages_file)
-        except FileNotFoundError:
-            self.logger.warning(
-                "Could not find reaction_messages.json file, making new one..."
-            )
-            with open(
-                self.reaction_messages_path, "w", encoding="utf-8"
-            ) as messages_file:
-                messages = {}
-                json.dump(messages, messages_file, indent=4)
-            return messages
-
-    def _save_reaction_messages(self):
-        """Save reaction messages to local json file"""
-        with open(self.reaction_messages_path, "w", encoding="utf-8") as messages_file:
-            json.dump(self.reaction_messages, messages_file, indent=4)
+    async def _load_reaction_messages(self) -> None:
+        """Load reaction messages from storage, importing the old json file once"""
+        await self.storage.create_tables(SCHEMA)
+        if await self.storage.migrate(
+            "roles.reaction_messages",
+            self.reaction_messages_path,
+            _convert_reaction_messages,
+        ):
+            self.logger.info("Imported reaction_messages.json into storage")
+        for message_id, channel_id in await self.storage.fetch_all(
+            "SELECT message_id, channel_id FROM reaction_messages"
+        ):
+            self.reaction_messages[str(message_id)] = {
+                "channel_id": channel_id,
+                "emojies": {},
+            }
+        for message_id, emoji, role_id in await self.storage.fetch_all(
+            "SELECT message_id, emoji, role_id FROM reaction_roles"
+        ):
+            if str(message_id) in self.reaction_messages:
+                self.reaction_messages[str(message_id)]["emojies"][emoji] = role_id
+
+    def _remove_reaction_message(self, message: str) -> None:
+        """Remove reaction message with its emojies"""
+        del self.reaction_messages[message]
+        self.storage.execute(
+            "DELETE FROM reaction_roles WHERE message_id = ?", (int(message),)
+        )
+        self.storage.execute(
+            "DELETE FROM reaction_messages WHERE message_id = ?", (int(message),)
+        )
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload: RawReactionActionEvent):
+        await self.state_loaded
         await self._procces_reaction(payload, "add")
 
     @commands.Cog.listener()
     async def on_raw_reaction_remove(self, payload: RawReactionActionEvent):
+        await self.state_loaded
         await self._procces_reaction(payload, "remove")
 
     @commands.Cog.listener()
@@ -162,8 +211,8 @@ class Roles(BaseCog):
 
         await fetched_message.add_reaction(emoji)
         self.reaction_messages[message]["emojies"][emoji] = role.id
+        self.storage.execute(INSERT_ROLE, (int(message), emoji, role.id))
         await ctx.send("Added emoji and role to message")
-        self._save_reaction_messages()
 
     @commands.guild_only()
     @commands.has_permissions(manage_roles=True)
@@ -181,8 +230,11 @@ class Roles(BaseCog):
 
         await fetched_message.clear_reaction(emoji)
         del self.reaction_messages[message]["emojies"][emoji]
+        self.storage.execute(
+            "DELETE FROM reaction_roles WHERE message_id = ? AND emoji = ?",
+            (int(message), emoji),
+        )
         await ctx.send("Removed emoji and role from message")
-        self._save_reaction_messages()
 
     @commands.guild_only()
     @commands.has_permissions(manage_roles=True)
@@ -228,7 +280,7 @@ class Roles(BaseCog):
             "channel_id": channel.id,
             "emojies": {},
         }
-        self._save_reaction_messages()
+        self.storage.execute(INSERT_MESSAGE, (message.id, channel.id))
         await ctx.send(f"Made new reaction message with ID: {message.id}")
 
     @commands.guild_only()
@@ -244,9 +296,8 @@ class Roles(BaseCog):
         fetched_message = await self._fetch_message(channel, int(message))
 
         await fetched_message.delete()
-        del self.reaction_messages[message]
+        self._remove_reaction_message(message)
         await ctx.send("Removed message")
-        self._save_reaction_messages()
 
     @commands.guild_only()
     @commands.has_permissions(manage_roles=True)
@@ -272,6 +323,7 @@ class Roles(BaseCog):
 
     @tasks.loop(hours=24)
     async def check_messages(self):
+        await self.state_loaded
         self.logger.info("Roles loop started")
         for message in self.reaction_messages.copy():
             try:
@@ -280,18 +332,17 @@ class Roles(BaseCog):
                 )
             except ChannelNotFound:
                 self.logger.warning(
-                    f"Channel not found for message {message}, removing message."
+                    "Channel not found for message %s, removing message.", message
                 )
-                del self.reaction_messages[message]
+                self._remove_reaction_message(message)
                 continue
             try:
                 fetched_message = await self._fetch_message(channel, int(message))
             except MessageNotFound:
-                self.logger.warning(f"Message {message} not found, removing message.")
-                del self.reaction_messages[message]
+                self.logger.warning("Message %s not found, removing message.", message)
+                self._remove_reaction_message(message)
                 continue
             for emoji in self.reaction_messages[message]["emojies"]:
                 if not await self._emoji_in_message(message, emoji):
                     await fetched_message.remove_reaction(emoji, self.bot.user)
-        self._save_reaction_messages()
         self.logger.info("Roles loop finished")
@@ -1,17 +1,20 @@
 """Urban dictionary bot commands cog module"""
-import json
 from urllib.parse import quote as urlquote
-from urllib.request import urlopen
 
 import discord
 from discord.ext import commands
 from core.basecog import BaseCog
+from core.http import HTTPError, get_http_client
+from core.singleflight import SingleFlight
 
 from .definition import Definition
 
 UD_URL = "https://api.urbandictionary.com/v0/define?term="
 UD_RANDOM = "https://api.urbandictionary.com/v0/random"
 
+# Users looking up a trending term at once share one api request
+_lookups = SingleFlight("urban")
+
 
 def _make_urbandict_embed(definition: Definition) -> discord.Embed:
     """Make an embed from a Definition object"""
@@ -46,12 +49,11 @@ def _parse_postition(word: str) -> tuple:
     return word, 0
 
 
-def _get_urban_json(url: str) -> dict:
+async def _get_urban_json(url: str) -> dict:
     """Get the json data from the urban dictionary api"""
     try:
-        with urlopen(url) as response:
-            return json.loads(response.read().decode("utf-8"))
-    except Exception:
+        return await get_http_client().get_json(url)
+    except (HTTPError, ValueError):
         return {"list": []}
 
 
@@ -65,12 +67,13 @@ def _parse_urban_json(json_data: dict, position: int) -> dict:
         return {}
 
 
-def _get_urban_definition(word: str, position: int) -> dict:
+async def _get_urban_definition(word: str, position: int) -> dict:
     """Get the urban dictionary definition for a word"""
-    url = UD_URL + urlquote(word)
     if word == "random":
-        url = UD_RANDOM
-    json_data = _get_urban_json(url)
+        json_data = await _get_urban_json(UD_RANDOM)
+    else:
+        url = UD_URL + urlquote(word)
+        json_data = await _lookups.do(url, _get_urban_json, url)
     return _parse_urban_json(json_data, position)
 
 
@@ -83,7 +86,7 @@ class Urban(BaseCog):
         word, position = _parse_postition(word)
         position = max(position, 0)
 
-        definition = _get_urban_definition(word, position)
+        definition = await _get_urban_definition(word, position)
         if definition == {}:
             await ctx.send("No definition found or index out of range")
             return